@@ -0,0 +1,90 @@
+# sorted as-of joins to put observations onto the forecast grid
+
+import datetime
+import typing
+
+import numpy as np
+import pandas as pd
+
+
+def to_naive_datetime(values: pd.Series) -> pd.Series:
+    # the forecast grid is naive local time, so we drop any timezone and use a single resolution
+    # (merge_asof refuses keys with different dtypes)
+    values = pd.to_datetime(values)
+    if values.dt.tz is not None:
+        values = values.dt.tz_localize(None)
+    return values.astype("datetime64[ns]")
+
+
+def asof_join(
+    grid: pd.DatetimeIndex,
+    frame: pd.DataFrame,
+    columns: typing.List[str],
+    on: str = "datetime",
+    tolerance: typing.Optional[pd.Timedelta] = None,
+    allow_exact_matches: bool = True,
+    direction: str = "backward",
+) -> pd.DataFrame:
+    # for every grid time we take the matching row of frame, with the default backward direction that
+    # is the last row at or before the grid time, both sides are sorted once so this is O(N + M)
+    left = pd.DataFrame({on: pd.DatetimeIndex(grid).astype("datetime64[ns]")})
+    if frame.empty or on not in frame.columns:
+        return pd.DataFrame(np.nan, index=grid, columns=columns)
+    right = frame[[on] + columns].copy()
+    right[on] = to_naive_datetime(right[on])
+    right = right.dropna(subset=[on]).sort_values(on, kind="stable")
+    # we need the sorted order of the grid for the join, the result goes back into the original order
+    order = np.argsort(left[on].to_numpy(), kind="stable")
+    merged = pd.merge_asof(
+        left.iloc[order],
+        right,
+        on=on,
+        tolerance=tolerance,
+        allow_exact_matches=allow_exact_matches,
+        direction=direction,
+    )
+    result = pd.DataFrame(index=grid, columns=columns, dtype="float64")
+    result.iloc[order] = merged[columns].to_numpy(dtype="float64", na_value=np.nan)
+    return result
+
+
+def align_observations(
+    grid: pd.DatetimeIndex,
+    station_data: pd.DataFrame,
+    waterlevels_df: pd.DataFrame,
+    now: datetime.datetime,
+    station_tolerance: typing.Optional[pd.Timedelta] = None,
+    allow_exact_matches: bool = False,
+) -> pd.DataFrame:
+    # the station and water level data for the whole grid, every model is joined against this afterwards
+    station_columns = ["smooth_wind_avg", "smooth_wind_min", "smooth_wind_max"]
+    # a grid time gets the last station measurement before it, minute data has to be strictly before,
+    # data that is already bucketed to the grid may also match exactly
+    observations = asof_join(
+        grid,
+        station_data,
+        station_columns,
+        tolerance=station_tolerance,
+        allow_exact_matches=allow_exact_matches,
+    )
+    # we remember where there was no earlier station data at all, these rows are dropped later
+    if station_data.empty:
+        observations["has_station_data"] = True
+    else:
+        first_measurement = to_naive_datetime(station_data["datetime"]).min()
+        if allow_exact_matches:
+            observations["has_station_data"] = grid >= first_measurement
+        else:
+            observations["has_station_data"] = grid > first_measurement
+    # there are no measurements in the future
+    observations.loc[grid > pd.Timestamp(now), station_columns] = np.nan
+    # the water levels are already rounded to the grid, so we only take exact matches
+    waterlevels = asof_join(
+        grid,
+        waterlevels_df.reset_index(),
+        ["value"],
+        tolerance=pd.Timedelta(0),
+    )
+    # waterlevel substract 500 to get the height in cm
+    observations["waterlevel"] = (waterlevels["value"] - 500) / 10
+    return observations
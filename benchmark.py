@@ -0,0 +1,765 @@
+# benchmarks for the forecast pipeline, run with synthetic data so no network is needed
+# the pipeline benchmark replays fixtures in the formats of the sources, recorded live or synthetic, through
+# every stage of get_forecast and reports the time, throughput and peak memory of each stage
+
+import argparse
+import datetime
+import json
+import os
+import time
+import tracemalloc
+
+import flatbuffers
+import numpy as np
+import openmeteo_requests
+import pandas as pd
+from openmeteo_sdk.WeatherApiResponse import WeatherApiResponse
+
+from asofjoin import align_observations, to_naive_datetime
+from gaprepair import repair_gaps, repair_model
+from gapreference import legacy_repair, make_gusts
+from getforecast import (
+    OPENMETEO_URL,
+    decode_models,
+    forecast_params,
+    join_observations,
+    merge_forecast,
+    round_waterlevels,
+    score_model,
+)
+from getstationdata import (
+    parse_meteostat,
+    parse_windguru,
+    request_meteostat,
+    request_windguru,
+    resample_to_grid,
+)
+from getwaterlevel import parse_pegelonline, request_pegelonline
+from httpclient import get_session
+from omresponse import MINUTELY_15_VARIABLES, decode_minutely_15
+from renderforecast import render_figure
+from spots import MODELS, STATIONS, get_spot
+
+# the fixtures of the pipeline benchmark, recorded ones and the synthetic ones of the sweeps
+FIXTURE_PATH = "/home/vhg/repos/wackerwind/data/benchmark/"
+
+
+def make_station_data(now, past_hours, seed=0):
+    # minute resolution station data, like windguru returns it
+    rng = np.random.default_rng(seed)
+    datetimes = pd.date_range(
+        end=now, periods=past_hours * 60, freq="1min", unit="ns"
+    ).floor("min")
+    wind = np.abs(rng.normal(12, 4, len(datetimes)))
+    df = pd.DataFrame({"datetime": datetimes, "wind_avg": wind})
+    df["smooth_wind_avg"] = df["wind_avg"].rolling(window=15).mean()
+    df["smooth_wind_min"] = (df["wind_avg"] - 3).rolling(window=15).min()
+    df["smooth_wind_max"] = (df["wind_avg"] + 5).rolling(window=15).max()
+    return df
+
+
+def make_waterlevels(now, past_hours):
+    datetimes = pd.date_range(end=now, periods=past_hours * 4, freq="15min").ceil(
+        "15min"
+    )
+    waterlevels_df = pd.DataFrame(
+        {"datetime": datetimes, "value": 500 + 10 * np.sin(np.arange(len(datetimes)))}
+    )
+    return waterlevels_df.set_index("datetime")
+
+
+def make_grid(now, past_hours, hours_to_show):
+    start = pd.Timestamp(now).floor("15min") - pd.Timedelta(hours=past_hours)
+    return pd.date_range(
+        start=start, periods=(past_hours + hours_to_show) * 4, freq="15min"
+    )
+
+
+def legacy_align(grid, station_data, now):
+    # the row by row lookup get_forecast used before the as-of join, kept for comparison
+    new_station_data = pd.DataFrame(columns=station_data.columns)
+    for this_datetime in grid:
+        station_data_row = (
+            station_data.loc[station_data["datetime"] < this_datetime]
+            .sort_values(by="datetime")
+            .tail(1)
+        )
+        if station_data_row.empty:
+            continue
+        if this_datetime > now:
+            new_station_data.loc[this_datetime, "smooth_wind_avg"] = np.nan
+            continue
+        new_station_data.loc[this_datetime] = station_data_row.iloc[0]
+    return new_station_data
+
+
+def bench_align(past_hours_list, hours_to_show, legacy_max_hours):
+    now = datetime.datetime(2024, 10, 13, 19, 37)
+    print(
+        f"{'past_hours':>10} {'grid rows':>10} {'station rows':>13} {'asof [s]':>10} {'us/row':>8} {'legacy [s]':>11}"
+    )
+    for past_hours in past_hours_list:
+        station_data = make_station_data(now, past_hours)
+        waterlevels_df = make_waterlevels(now, past_hours)
+        grid = make_grid(now, past_hours, hours_to_show)
+        start = time.perf_counter()
+        observations = align_observations(grid, station_data, waterlevels_df, now)
+        asof_time = time.perf_counter() - start
+        legacy_time = ""
+        if past_hours <= legacy_max_hours:
+            start = time.perf_counter()
+            legacy = legacy_align(grid, station_data, now)
+            legacy_time = f"{time.perf_counter() - start:.3f}"
+            # both must agree on every row that has station data
+            kept = observations[observations["has_station_data"]]
+            assert len(kept) == len(legacy)
+            assert np.allclose(
+                kept["smooth_wind_avg"].to_numpy(dtype=float),
+                legacy["smooth_wind_avg"].to_numpy(dtype=float),
+                equal_nan=True,
+            )
+        rows = len(grid) + len(station_data)
+        print(
+            f"{past_hours:>10} {len(grid):>10} {len(station_data):>13} {asof_time:>10.4f} {asof_time / rows * 1e6:>8.3f} {legacy_time:>11}"
+        )
+
+
+def bench_repair(past_hours_list, hours_to_show, legacy_max_hours):
+    print(
+        f"{'past_hours':>10} {'rows':>8} {'gaps':>6} {'vectorized [s]':>15} {'us/row':>8} {'legacy [s]':>11}"
+    )
+    for past_hours in past_hours_list:
+        rows = (past_hours + hours_to_show) * 4
+        for gap_share in [0.0, 0.01, 0.05]:
+            gusts = make_gusts(rows, gap_share, seed=past_hours)
+            start = time.perf_counter()
+            repaired = repair_gaps(gusts)
+            repair_time = time.perf_counter() - start
+            legacy_time = ""
+            if past_hours <= legacy_max_hours:
+                start = time.perf_counter()
+                legacy = legacy_repair(gusts)
+                legacy_time = f"{time.perf_counter() - start:.3f}"
+                # the vectorized repair must give the very same values, not only close ones
+                assert repaired.dtype == legacy.dtype
+                assert np.array_equal(repaired, legacy, equal_nan=True)
+            print(
+                f"{past_hours:>10} {rows:>8} {int((gusts == 0).sum()):>6} {repair_time:>15.5f} {repair_time / rows * 1e6:>8.3f} {legacy_time:>11}"
+            )
+    # a run of zeros repairs into zeros again, the vectorized repair has to fall back to the loop
+    for gusts in [np.zeros(40, dtype="float32"), make_gusts(200, 0.3, seed=1)]:
+        assert np.array_equal(repair_gaps(gusts), legacy_repair(gusts), equal_nan=True)
+
+
+def encode_response(
+    values, start, interval=900, utc_offset_seconds=7200, model_number=23
+):
+    # a WeatherApiResponse flatbuffer with a minutely_15 block, values has one array per variable
+    builder = flatbuffers.Builder(1024)
+    variables = []
+    for variable_values in values:
+        vector = builder.CreateNumpyVector(np.asarray(variable_values, dtype="float32"))
+        # VariableWithValues, the values are field 3
+        builder.StartObject(14)
+        builder.PrependUOffsetTRelativeSlot(3, vector, 0)
+        variables.append(builder.EndObject())
+    builder.StartVector(4, len(variables), 4)
+    for variable in reversed(variables):
+        builder.PrependUOffsetTRelative(variable)
+    variables_vector = builder.EndVector()
+    # VariablesWithTime: time, time_end, interval, variables
+    builder.StartObject(4)
+    builder.PrependInt64Slot(0, start, 0)
+    builder.PrependInt64Slot(1, start + len(values[0]) * interval, 0)
+    builder.PrependInt32Slot(2, interval, 0)
+    builder.PrependUOffsetTRelativeSlot(3, variables_vector, 0)
+    minutely_15 = builder.EndObject()
+    # WeatherApiResponse: model is field 5, utc offset 6 and minutely_15 12
+    builder.StartObject(15)
+    builder.PrependUint8Slot(5, model_number, 0)
+    builder.PrependInt32Slot(6, utc_offset_seconds, 0)
+    builder.PrependUOffsetTRelativeSlot(12, minutely_15, 0)
+    builder.Finish(builder.EndObject())
+    # the api sends every response with its size in front
+    output = bytes(builder.Output())
+    return len(output).to_bytes(4, "little") + output
+
+
+def make_response(
+    values, start, interval=900, utc_offset_seconds=7200, model_number=23
+):
+    return WeatherApiResponse.GetRootAs(
+        encode_response(values, start, interval, utc_offset_seconds, model_number), 4
+    )
+
+
+def legacy_decode(response):
+    # the decoding get_forecast and save_forecast used before omresponse, kept for comparison
+    minutely_15 = response.Minutely15()
+    minutely_15_data = {
+        "date": pd.date_range(
+            start=pd.to_datetime(minutely_15.Time(), unit="s", utc=True),
+            end=pd.to_datetime(minutely_15.TimeEnd(), unit="s", utc=True),
+            freq=pd.Timedelta(seconds=minutely_15.Interval()),
+            inclusive="left",
+        )
+    }
+    for i, variable in enumerate(MINUTELY_15_VARIABLES):
+        minutely_15_data[variable] = minutely_15.Variables(i).ValuesAsNumpy()
+    df = pd.DataFrame(data=minutely_15_data)
+    df["date"] = df["date"] + pd.Timedelta(seconds=response.UtcOffsetSeconds())
+    df["date"] = df["date"].dt.strftime("%Y-%m-%dT%H:%M:%S")
+    df["datetime"] = pd.to_datetime(df["date"])
+    return df
+
+
+def bench_decode(past_hours_list, hours_to_show, repeat=5):
+    print(
+        f"{'past_hours':>10} {'rows':>8} {'decoder [ms]':>13} {'legacy [ms]':>12} {'speedup':>8}"
+    )
+    rng = np.random.default_rng(0)
+    for past_hours in past_hours_list:
+        rows = (past_hours + hours_to_show) * 4
+        values = [
+            rng.normal(10, 5, rows).astype("float32") for _ in MINUTELY_15_VARIABLES
+        ]
+        response = make_response(values, 1728835200 - past_hours * 3600)
+        timings = {}
+        frames = {}
+        for name, decode in [
+            ("decoder", decode_minutely_15),
+            ("legacy", legacy_decode),
+        ]:
+            start = time.perf_counter()
+            for _ in range(repeat):
+                frames[name] = decode(response)
+            timings[name] = (time.perf_counter() - start) / repeat
+        decoded, legacy = frames["decoder"], frames["legacy"]
+        # the same valid times and values, only without the string round trip
+        assert (decoded["datetime"] == legacy["datetime"]).all()
+        for variable in MINUTELY_15_VARIABLES:
+            assert np.array_equal(decoded[variable], legacy[variable], equal_nan=True)
+        print(
+            f"{past_hours:>10} {rows:>8} {timings['decoder'] * 1e3:>13.3f} {timings['legacy'] * 1e3:>12.3f} {timings['legacy'] / timings['decoder']:>8.1f}"
+        )
+
+
+def make_fixture(now, past_hours, hours_to_show, models, source, seed=0):
+    # a fixture in the formats the sources answer with, minute station data for windguru and hourly for meteostat
+    rng = np.random.default_rng(seed)
+    local_now = pd.Timestamp(now).tz_localize("Europe/Berlin")
+    utc_offset_seconds = int(local_now.utcoffset().total_seconds())
+    rows = (past_hours + hours_to_show) * 4
+    start = int(local_now.floor("15min").timestamp()) - past_hours * 3600
+    forecast = b""
+    for model in models:
+        speed = np.abs(rng.normal(12, 4, rows))
+        gusts = speed + np.abs(rng.normal(5, 2, rows))
+        if model == "icon_d2":
+            # icon_d2 has no gusts for some of the past
+            gusts[: past_hours * 4 : 4] = 0
+        values = {
+            "apparent_temperature": rng.normal(10, 3, rows),
+            "precipitation": np.abs(rng.normal(0, 0.2, rows)),
+            "wind_speed_10m": speed,
+            "wind_direction_10m": rng.uniform(0, 360, rows),
+            "wind_gusts_10m": gusts,
+        }
+        forecast += encode_response(
+            [values[variable] for variable in MINUTELY_15_VARIABLES],
+            start,
+            utc_offset_seconds=utc_offset_seconds,
+            model_number=MODELS[model]["number"],
+        )
+    freq = "1min" if source == "windguru" else "1h"
+    times = pd.date_range(
+        end=local_now,
+        periods=past_hours * (60 if source == "windguru" else 1),
+        freq=freq,
+    ).floor(freq)
+    wind = np.abs(rng.normal(12, 4, len(times))).round(1)
+    if source == "windguru":
+        station = {
+            "datetime": list(times.tz_localize(None).strftime("%Y-%m-%d %H:%M:%S")),
+            # windguru has wind_avg and wind_min mixed up
+            "wind_min": wind.tolist(),
+            "wind_avg": (wind - 3).clip(0).tolist(),
+            "wind_max": (wind + 5).tolist(),
+            "temperature": rng.normal(10, 3, len(times)).round(1).tolist(),
+        }
+    else:
+        station = {
+            "data": [
+                {
+                    "time": time,
+                    "temp": 10.0,
+                    "wspd": speed,
+                    "wpgt": speed + 9,
+                    "wdir": 270,
+                }
+                for time, speed in zip(
+                    times.tz_localize(None).strftime("%Y-%m-%d %H:%M:%S"),
+                    (wind * 1.852).round(1),
+                )
+            ]
+        }
+    waterlevel_times = pd.date_range(
+        end=local_now, periods=past_hours * 60, freq="1min"
+    ).floor("min")
+    waterlevel = [
+        {"timestamp": time.isoformat(), "value": value}
+        for time, value in zip(
+            waterlevel_times,
+            (500 + 10 * np.sin(np.arange(len(waterlevel_times)) / 200)).round(0),
+        )
+    ]
+    manifest = {
+        "location": "wac",
+        "models": list(models),
+        "source": source,
+        "now": pd.Timestamp(now).isoformat(),
+        "past_hours": past_hours,
+        "hours_to_show": hours_to_show,
+        "recorded": False,
+    }
+    return {
+        "manifest": manifest,
+        "forecast": forecast,
+        "station": station,
+        "waterlevel": waterlevel,
+    }
+
+
+def record_fixture(location, past_hours, hours_to_show):
+    # the live answers of every source for a spot, to replay them later without the network
+    spot = get_spot(location)
+    now = datetime.datetime.now()
+    from_time = now - datetime.timedelta(hours=past_hours)
+    params = forecast_params(spot, hours_to_show, past_hours * 4)
+    # the open-meteo client asks for this format
+    params["format"] = "flatbuffers"
+    response = get_session().get(OPENMETEO_URL, params=params)
+    response.raise_for_status()
+    source = STATIONS[spot["station"]]["source"]
+    request = request_windguru if source == "windguru" else request_meteostat
+    manifest = {
+        "location": spot["name"],
+        "models": spot["models"],
+        "source": source,
+        "now": now.isoformat(),
+        "past_hours": past_hours,
+        "hours_to_show": hours_to_show,
+        "recorded": True,
+    }
+    return {
+        "manifest": manifest,
+        "forecast": response.content,
+        "station": request(spot["station"], from_time, now),
+        "waterlevel": request_pegelonline(spot["waterlevel"], from_time, now),
+    }
+
+
+def write_fixture(fixture, path):
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, "manifest.json"), "w") as f:
+        json.dump(fixture["manifest"], f, indent=1)
+    with open(os.path.join(path, "forecast.bin"), "wb") as f:
+        f.write(fixture["forecast"])
+    for name in ["station", "waterlevel"]:
+        with open(os.path.join(path, f"{name}.json"), "w") as f:
+            json.dump(fixture[name], f)
+
+
+def read_fixture(path):
+    fixture = {}
+    with open(os.path.join(path, "manifest.json")) as f:
+        fixture["manifest"] = json.load(f)
+    with open(os.path.join(path, "forecast.bin"), "rb") as f:
+        fixture["forecast"] = f.read()
+    for name in ["station", "waterlevel"]:
+        with open(os.path.join(path, f"{name}.json")) as f:
+            fixture[name] = json.load(f)
+    return fixture
+
+
+class ReplayResponse:
+    # the part of a response the open-meteo client uses
+    def __init__(self, content):
+        self.content = content
+        self.status_code = 200
+
+    def raise_for_status(self):
+        pass
+
+
+class ReplaySession:
+    # answers every request of the open-meteo client with the recorded forecast
+    def __init__(self, content):
+        self.content = content
+
+    def get(self, url, params=None, **kwargs):
+        return ReplayResponse(self.content)
+
+
+def measure(function, repeat=3):
+    # the best wall time of repeat runs, then the peak of the python allocations of one more run
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        seconds.append(time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        function()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return result, min(seconds), peak
+
+
+def run_pipeline(fixture, repeat=3):
+    # every stage of get_forecast on the fixture, the output of one stage is the input of the next
+    manifest = fixture["manifest"]
+    now = datetime.datetime.fromisoformat(manifest["now"])
+    models = manifest["models"]
+    openmeteo = openmeteo_requests.Client(session=ReplaySession(fixture["forecast"]))
+    parse_station = (
+        parse_windguru if manifest["source"] == "windguru" else parse_meteostat
+    )
+    stages = []
+
+    def stage(name, function, rows):
+        result, seconds, peak = measure(function, repeat)
+        stages.append(
+            {
+                "stage": name,
+                "rows": rows(result),
+                "seconds": seconds,
+                "peak_bytes": peak,
+            }
+        )
+        return result
+
+    model_frames = stage(
+        "decode",
+        lambda: decode_models(
+            openmeteo.weather_api(OPENMETEO_URL, params={}), MINUTELY_15_VARIABLES
+        ),
+        lambda frames: sum(len(df) for df in frames.values()),
+    )
+    station_data = stage(
+        "station",
+        lambda: resample_to_grid(parse_station(fixture["station"]), "15min"),
+        lambda df: len(df),
+    )
+    waterlevels = stage(
+        "waterlevel",
+        lambda: parse_pegelonline(fixture["waterlevel"]).set_index("datetime")["value"],
+        lambda series: len(series),
+    )
+    waterlevels_df = round_waterlevels(waterlevels)
+    station_data["datetime"] = to_naive_datetime(station_data["datetime"])
+    grid = pd.DatetimeIndex([])
+    for df in model_frames.values():
+        grid = grid.union(df.index)
+    observations = stage(
+        "align",
+        lambda: align_observations(
+            grid, station_data, waterlevels_df, now, allow_exact_matches=True
+        ),
+        lambda df: len(df),
+    )
+    joined = {
+        model: join_observations(df, observations) for model, df in model_frames.items()
+    }
+    repaired = stage(
+        "repair",
+        lambda: {model: repair_model(df.copy(), model) for model, df in joined.items()},
+        lambda frames: sum(len(df) for df in frames.values()),
+    )
+
+    # every model is scored on its own, like process_model does
+    stage(
+        "mse",
+        lambda: {
+            model: score_model(pd.DataFrame(), df, model)
+            for model, df in repaired.items()
+        },
+        lambda frames: sum(len(df) for df in frames.values()),
+    )
+    # the whole merge again, with everything get_forecast does between the stages
+    forecast = stage(
+        "merge",
+        lambda: merge_forecast(
+            manifest["location"],
+            models,
+            openmeteo.weather_api(OPENMETEO_URL, params={}),
+            resample_to_grid(parse_station(fixture["station"]), "15min"),
+            waterlevels,
+            now,
+        ),
+        lambda forecast: sum(len(df) for df in model_frames.values()),
+    )
+    stage(
+        "plot",
+        lambda: render_figure(forecast, "forecast", "png"),
+        lambda png: len(forecast["cube"]),
+    )
+    return stages
+
+
+def bench_pipeline(
+    past_hours_list,
+    hours_to_show,
+    model_counts,
+    sources,
+    fixture_paths=None,
+    fixture_path=FIXTURE_PATH,
+    repeat=3,
+    results_path=None,
+):
+    # the synthetic fixtures are written once and replayed from disk like the recorded ones
+    now = datetime.datetime(2024, 10, 13, 19, 37)
+    paths = list(fixture_paths or [])
+    for source in sources:
+        for model_count in model_counts:
+            for past_hours in past_hours_list:
+                path = os.path.join(
+                    fixture_path,
+                    f"synthetic_{source}_{model_count}m_{past_hours}p_{hours_to_show}h",
+                )
+                if not os.path.exists(os.path.join(path, "manifest.json")):
+                    write_fixture(
+                        make_fixture(
+                            now,
+                            past_hours,
+                            hours_to_show,
+                            list(MODELS)[:model_count],
+                            source,
+                        ),
+                        path,
+                    )
+                paths.append(path)
+    print(
+        f"{'fixture':>36} {'stage':>10} {'rows':>8} {'time [ms]':>10} {'rows/s':>11} {'peak [MiB]':>11}"
+    )
+    for path in paths:
+        fixture = read_fixture(path)
+        stages = run_pipeline(fixture, repeat)
+        for result in stages:
+            print(
+                f"{os.path.basename(path.rstrip('/')):>36} {result['stage']:>10} {result['rows']:>8} {result['seconds'] * 1e3:>10.2f} {result['rows'] / result['seconds']:>11.0f} {result['peak_bytes'] / 2**20:>11.2f}"
+            )
+        if results_path:
+            with open(results_path, "a") as f:
+                for result in stages:
+                    f.write(
+                        json.dumps(
+                            {
+                                "time": datetime.datetime.now().isoformat(),
+                                "fixture": os.path.basename(path.rstrip("/")),
+                                **fixture["manifest"],
+                                **result,
+                            }
+                        )
+                        + "\n"
+                    )
+
+
+def bench_models(past_hours_list, hours_to_show, model_counts, worker_counts, repeat=3):
+    # merge_forecast with its models processed in a pool of each size against one by one in this process,
+    # without tracemalloc, it would only slow down the work in this process
+    now = datetime.datetime(2024, 10, 13, 19, 37)
+    print(
+        f"{'past_hours':>10} {'models':>6} {'workers':>7} {'time [ms]':>10} {'speedup':>8}"
+    )
+    for model_count in model_counts:
+        for past_hours in past_hours_list:
+            fixture = make_fixture(
+                now, past_hours, hours_to_show, list(MODELS)[:model_count], "windguru"
+            )
+            openmeteo = openmeteo_requests.Client(
+                session=ReplaySession(fixture["forecast"])
+            )
+            responses = openmeteo.weather_api(OPENMETEO_URL, params={})
+            station_data = resample_to_grid(parse_windguru(fixture["station"]), "15min")
+            waterlevels = parse_pegelonline(fixture["waterlevel"]).set_index(
+                "datetime"
+            )["value"]
+            sequential = None
+            cube = None
+            for workers in worker_counts:
+                times = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    forecast = merge_forecast(
+                        "wac",
+                        fixture["manifest"]["models"],
+                        responses,
+                        # merge_forecast changes the station data
+                        station_data.copy(),
+                        waterlevels,
+                        now,
+                        model_workers=workers,
+                    )
+                    times.append(time.perf_counter() - start)
+                # every pool size has to give the very same cube
+                if cube is None:
+                    cube = forecast["cube"]
+                assert np.array_equal(
+                    forecast["cube"].values, cube.values, equal_nan=True
+                )
+                best = min(times)
+                if sequential is None:
+                    sequential = best
+                print(
+                    f"{past_hours:>10} {model_count:>6} {workers:>7} {best * 1e3:>10.2f} {sequential / best:>8.2f}"
+                )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the forecast pipeline")
+    parser.add_argument(
+        "-b",
+        "--benchmarks",
+        type=str,
+        nargs="+",
+        choices=["align", "repair", "decode", "pipeline", "models"],
+        help="Benchmarks to run",
+        required=False,
+        default=["align", "repair", "decode", "pipeline", "models"],
+    )
+    parser.add_argument(
+        "-p",
+        "--past_hours",
+        type=int,
+        nargs="+",
+        help="Past hours to benchmark",
+        required=False,
+        default=[18, 72, 276, 552, 1104, 2208],
+    )
+    parser.add_argument(
+        "-t",
+        "--hours_to_show",
+        type=int,
+        help="Number of forecast hours",
+        required=False,
+        default=72,
+    )
+    parser.add_argument(
+        "--legacy_max_hours",
+        type=int,
+        help="Also run the old row by row alignment up to this many past hours",
+        required=False,
+        default=72,
+    )
+    parser.add_argument(
+        "-m",
+        "--model_counts",
+        type=int,
+        nargs="+",
+        help="Numbers of models the pipeline benchmark sweeps",
+        required=False,
+        default=[1, 4],
+    )
+    parser.add_argument(
+        "-s",
+        "--sources",
+        type=str,
+        nargs="+",
+        choices=["windguru", "meteostat"],
+        help="Station sources the pipeline benchmark sweeps, minute or hourly measurements",
+        required=False,
+        default=["windguru", "meteostat"],
+    )
+    parser.add_argument(
+        "-f",
+        "--fixtures",
+        type=str,
+        nargs="+",
+        help="Directories of recorded fixtures to run the pipeline benchmark on as well",
+        required=False,
+        default=[],
+    )
+    parser.add_argument(
+        "--record",
+        type=str,
+        nargs="+",
+        help="Record fixtures of these spots from the live sources first",
+        required=False,
+        default=[],
+    )
+    parser.add_argument(
+        "--fixture_path",
+        type=str,
+        help="Directory of the fixtures",
+        required=False,
+        default=FIXTURE_PATH,
+    )
+    parser.add_argument(
+        "-r",
+        "--repeat",
+        type=int,
+        help="Runs per stage, the fastest one counts",
+        required=False,
+        default=3,
+    )
+    parser.add_argument(
+        "-o",
+        "--results",
+        type=str,
+        help="Append the pipeline results as json lines to this file",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "-w",
+        "--model_workers",
+        type=int,
+        nargs="+",
+        help="Model worker counts the models benchmark compares, the first one is the baseline",
+        required=False,
+        default=[1, 2, 4],
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if "align" in args.benchmarks:
+        bench_align(args.past_hours, args.hours_to_show, args.legacy_max_hours)
+    if "repair" in args.benchmarks:
+        bench_repair(args.past_hours, args.hours_to_show, args.legacy_max_hours)
+    if "decode" in args.benchmarks:
+        bench_decode(args.past_hours, args.hours_to_show)
+    fixtures = list(args.fixtures)
+    for location in args.record:
+        # a recorded fixture covers the first of the past hours
+        path = os.path.join(
+            args.fixture_path,
+            f"recorded_{location}_{datetime.datetime.now():%Y%m%d%H%M}",
+        )
+        write_fixture(
+            record_fixture(location, args.past_hours[0], args.hours_to_show), path
+        )
+        print(f"Recorded {location} to {path}")
+        fixtures.append(path)
+    if "pipeline" in args.benchmarks:
+        bench_pipeline(
+            args.past_hours,
+            args.hours_to_show,
+            args.model_counts,
+            args.sources,
+            fixtures,
+            args.fixture_path,
+            args.repeat,
+            args.results,
+        )
+    if "models" in args.benchmarks:
+        bench_models(
+            args.past_hours,
+            args.hours_to_show,
+            args.model_counts,
+            args.model_workers,
+            args.repeat,
+        )
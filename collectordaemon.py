@@ -0,0 +1,144 @@
+# keeps running and saves the forecast of each model when a new run of it is expected
+# the client and its session stay open between ticks, so there is no start up cost per run
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import time
+
+from instrumentation import configure
+from saveforecast import get_client, save_forecasts
+from spots import MODELS, SPOTS, collected_spots
+
+# a new run is usually available a while after its cycle started
+FIRST_POLL_MINUTES = 15
+# if it was not there yet we try again after this many minutes
+RETRY_MINUTES = 15
+TICK_LOG = "/home/vhg/repos/wackerwind/data/collector_ticks.jsonl"
+# the session stays open, but a cached response must not hide a new run from the next poll
+CACHE_SECONDS = 60
+logger = logging.getLogger(__name__)
+
+
+def cycle_start(now: datetime.datetime, update_hours: int) -> datetime.datetime:
+    # the cycles of a model start every update_hours hours, counted from midnight UTC
+    midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    hours = (now - midnight) // datetime.timedelta(hours=update_hours) * update_hours
+    return midnight + datetime.timedelta(hours=hours)
+
+
+def next_poll(
+    now: datetime.datetime, update_hours: int, got_new_data: bool
+) -> datetime.datetime:
+    next_cycle = (
+        cycle_start(now, update_hours)
+        + datetime.timedelta(hours=update_hours)
+        + datetime.timedelta(minutes=FIRST_POLL_MINUTES)
+    )
+    if got_new_data:
+        return next_cycle
+    # the run of this cycle is late, we try again soon but not later than the next cycle
+    return min(now + datetime.timedelta(minutes=RETRY_MINUTES), next_cycle)
+
+
+def record_tick(tick: dict, tick_log: str = TICK_LOG):
+    logger.info(
+        "Tick at %s for %s took %.2fs, saved %s rows",
+        tick["time"],
+        tick["models"],
+        tick["seconds"],
+        tick["saved_rows"],
+    )
+    if tick_log:
+        os.makedirs(os.path.dirname(tick_log), exist_ok=True)
+        with open(tick_log, "a") as f:
+            f.write(json.dumps(tick) + "\n")
+
+
+def tick(openmeteo, due_models, next_due, hours_to_show, tick_log=TICK_LOG):
+    # polls all due models in one go and works out when to poll each of them next
+    start = time.monotonic()
+    now = datetime.datetime.now(datetime.timezone.utc)
+    try:
+        saved_rows = save_forecasts(
+            collected_spots(), hours_to_show, openmeteo=openmeteo, models=due_models
+        )
+    except Exception:
+        # the daemon keeps running, the models are retried like a late run
+        logger.exception("Tick failed")
+        saved_rows = {}
+    for model in due_models:
+        new_rows = sum(
+            rows
+            for (_, saved_model), rows in saved_rows.items()
+            if saved_model == model
+        )
+        next_due[model] = next_poll(now, MODELS[model]["update_hours"], new_rows > 0)
+    record_tick(
+        {
+            "time": now.isoformat(),
+            "models": due_models,
+            "seconds": time.monotonic() - start,
+            "saved_rows": sum(saved_rows.values()),
+        },
+        tick_log,
+    )
+
+
+def run(hours_to_show=36, once=False, tick_log=TICK_LOG):
+    openmeteo = get_client(expire_after=CACHE_SECONDS)
+    collected_models = sorted(
+        {model for name in collected_spots() for model in SPOTS[name]["collect"]}
+    )
+    # every model is polled once right at the start
+    now = datetime.datetime.now(datetime.timezone.utc)
+    next_due = {model: now for model in collected_models}
+    while True:
+        now = datetime.datetime.now(datetime.timezone.utc)
+        due_models = [model for model, due in next_due.items() if due <= now]
+        if due_models:
+            tick(openmeteo, due_models, next_due, hours_to_show, tick_log)
+            if once:
+                return
+            continue
+        wait = (min(next_due.values()) - now).total_seconds()
+        logger.info("Sleeping %.0fs until %s", wait, min(next_due.values()))
+        time.sleep(max(wait, 1))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Keep saving forecasts whenever a model has a new run"
+    )
+    parser.add_argument(
+        "-t",
+        "--hours_to_show",
+        type=int,
+        help="Number of forecast hours to save",
+        required=False,
+        default=36,
+    )
+    parser.add_argument(
+        "--once",
+        action="store_true",
+        help="Poll every model once and exit",
+    )
+    parser.add_argument(
+        "--tick_log",
+        type=str,
+        help="JSON lines file the tick latencies are appended to, empty to disable",
+        required=False,
+        default=TICK_LOG,
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    configure()
+    try:
+        run(args.hours_to_show, args.once, args.tick_log)
+    except KeyboardInterrupt:
+        logger.info("Stopped")
@@ -3,6 +3,8 @@
 import pandas as pd
 import argparse
 
+from forecastarchive import archive_lock, rebuild_latest, write_latest
+
 
 # args are: hdf5 file name, number of rows to drop
 def parse_args():
@@ -26,14 +28,17 @@ def parse_args():
 
 def main():
     args = parse_args()
-    with pd.HDFStore(args.hdf5file) as store:
-        df = store["data"]
-        print("Before")
-        print(df.to_string())
-        df = df.drop(df.tail(args.nrows).index)
-        print("After")
-        print(df.to_string())
-        store.put("data", df, format="table")
+    # the collector must not append while we change the table
+    with archive_lock(args.hdf5file), pd.HDFStore(args.hdf5file) as store:
+        nrows = store.get_storer("data").nrows
+        start = max(nrows - args.nrows, 0)
+        # a valid time is in the table once per lead hour, so we drop the last rows by position, not by index
+        print("Dropping")
+        print(store.select("data", start=start).to_string())
+        if start < nrows:
+            store.remove("data", start=start, stop=nrows)
+        write_latest(store, rebuild_latest(store))
+        print(f"{store.get_storer('data').nrows} rows left")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,53 @@
+# fetch several sources at the same time, so a run only waits for the slowest one
+
+import concurrent.futures
+import logging
+import time
+import typing
+
+# seconds we wait for each kind of source before we give up on it
+SOURCE_TIMEOUTS = {
+    "forecast": 30,
+    "station": 60,
+    "waterlevel": 20,
+}
+logger = logging.getLogger(__name__)
+
+
+def fetch_all(
+    jobs: typing.Dict[typing.Hashable, typing.Tuple[typing.Callable, tuple, float]],
+    max_workers: typing.Optional[int] = None,
+) -> typing.Tuple[
+    typing.Dict[typing.Hashable, typing.Any], typing.Dict[typing.Hashable, Exception]
+]:
+    # jobs maps a key, e.g. ("station", "wak"), to (function, args, timeout in seconds)
+    # every job is started at once, we return the results and the errors keyed like the jobs,
+    # a job that failed or ran out of time only shows up in the errors
+    results = {}
+    errors = {}
+    if not jobs:
+        return results, errors
+    executor = concurrent.futures.ThreadPoolExecutor(
+        max_workers=max_workers or len(jobs)
+    )
+    start = time.monotonic()
+    futures = {
+        key: executor.submit(function, *args)
+        for key, (function, args, timeout) in jobs.items()
+    }
+    try:
+        for key, future in futures.items():
+            # the timeouts count from the start, not from when we got to this job
+            remaining = max(0, start + jobs[key][2] - time.monotonic())
+            try:
+                results[key] = future.result(timeout=remaining)
+            except concurrent.futures.TimeoutError:
+                errors[key] = TimeoutError(f"{key} took longer than {jobs[key][2]}s")
+            except Exception as e:
+                errors[key] = e
+    finally:
+        # we do not wait for jobs that ran out of time
+        executor.shutdown(wait=False, cancel_futures=True)
+    for key, error in errors.items():
+        logger.warning("Fetching %s failed: %s", key, error)
+    return results, errors
@@ -0,0 +1,465 @@
+# the forecast archive, one table per location and model with every lead hour in it
+# rows are keyed by (lead_hour, valid time, save_time), the valid time is the index of the table
+
+import argparse
+import concurrent.futures
+import contextlib
+import fcntl
+import logging
+import os
+import re
+import typing
+
+import pandas as pd
+
+from instrumentation import configure
+
+ARCHIVE_PATH = "/home/vhg/repos/wackerwind/data/archive/"
+LEGACY_PATH = "/home/vhg/repos/wackerwind/data/forecasts/"
+VALUE_COLUMNS = [
+    "wind_speed_10m",
+    "wind_gusts_10m",
+    "wind_direction_10m",
+    "apparent_temperature",
+    "precipitation",
+]
+# these can be used in where clauses, the index (valid time) always can
+DATA_COLUMNS = ["lead_hour", "save_time"]
+# compacting rewrites a file this many days of valid time at a time
+COMPACT_CHUNK_DAYS = 30
+COMPACT_WORKERS = 4
+# rows per chunk when streaming the archive, about 5 MB of values
+READ_CHUNK_ROWS = 100_000
+logger = logging.getLogger(__name__)
+
+
+def archive_file(location: str, model: str, archive_path: str = ARCHIVE_PATH) -> str:
+    return os.path.join(archive_path, f"{location}_{model}.h5")
+
+
+def to_archive_frame(
+    df: pd.DataFrame, lead_hour: int, save_time: typing.Any = None
+) -> pd.DataFrame:
+    # df has a datetime column with the valid time and the forecast values,
+    # without a save_time we take the one in the save_time column of df
+    frame = pd.DataFrame(
+        {
+            column: df[column].to_numpy(dtype="float32")
+            for column in VALUE_COLUMNS
+            if column in df.columns
+        },
+        index=pd.DatetimeIndex(
+            pd.to_datetime(df["datetime"]).to_numpy(dtype="datetime64[ns]"),
+            name="datetime",
+        ),
+    )
+    frame["lead_hour"] = pd.Series(lead_hour, index=frame.index, dtype="int16")
+    if save_time is None:
+        save_time = pd.to_datetime(df["save_time"]).to_numpy(dtype="datetime64[ns]")
+    else:
+        save_time = pd.Timestamp(save_time)
+    frame["save_time"] = pd.Series(save_time, index=frame.index, dtype="datetime64[ns]")
+    return frame
+
+
+def empty_latest() -> pd.DataFrame:
+    return pd.DataFrame(
+        {
+            "valid_time": pd.Series(dtype="datetime64[ns]"),
+            "save_time": pd.Series(dtype="datetime64[ns]"),
+        },
+        index=pd.Index([], dtype="int16", name="lead_hour"),
+    )
+
+
+def rebuild_latest(store: pd.HDFStore) -> pd.DataFrame:
+    # the only place where the data table is scanned, and only the key columns of it
+    if "data" not in store:
+        return empty_latest()
+    keys = store.select("data", columns=["lead_hour", "save_time"])
+    if keys.empty:
+        return empty_latest()
+    keys = keys.rename_axis("valid_time").reset_index()
+    return keys.groupby("lead_hour").agg(
+        valid_time=("valid_time", "max"), save_time=("save_time", "max")
+    )
+
+
+def read_latest(store: pd.HDFStore) -> pd.DataFrame:
+    # the latest valid time and save time per lead hour, they are kept in a small table next to the data
+    # the index remembers how many data rows it covers, if that does not match (e.g. the run stopped
+    # between writing the data and the index) we rebuild it from the data
+    if "data" not in store:
+        return empty_latest()
+    if "latest" in store:
+        indexed_rows = getattr(store.get_storer("latest").attrs, "data_nrows", None)
+        if indexed_rows == store.get_storer("data").nrows:
+            return store["latest"]
+    logger.info("Rebuilding the latest index")
+    return rebuild_latest(store)
+
+
+def write_latest(store: pd.HDFStore, latest: pd.DataFrame):
+    store.put("latest", latest, format="fixed")
+    store.get_storer("latest").attrs.data_nrows = (
+        store.get_storer("data").nrows if "data" in store else 0
+    )
+
+
+def append_forecast(
+    store: pd.HDFStore,
+    df: pd.DataFrame,
+    lead_hour: int,
+    save_time: typing.Any = None,
+) -> int:
+    frame = to_archive_frame(df, lead_hour, save_time)
+    if frame.empty:
+        return 0
+    latest = read_latest(store)
+    # we do not update the table index on every hourly append, compacting the archive does that
+    store.append(
+        "data",
+        frame,
+        format="table",
+        data_columns=DATA_COLUMNS,
+        complib="blosc",
+        complevel=9,
+        index=False,
+    )
+    # the latest index is updated right after every append
+    valid_time = frame.index.max()
+    saved_time = frame["save_time"].max()
+    if lead_hour in latest.index:
+        valid_time = max(valid_time, latest.loc[lead_hour, "valid_time"])
+        saved_time = max(saved_time, latest.loc[lead_hour, "save_time"])
+    latest.loc[lead_hour] = [valid_time, saved_time]
+    write_latest(store, latest.sort_index())
+    return len(frame)
+
+
+def last_valid_time(
+    store: pd.HDFStore, lead_hour: int
+) -> typing.Optional[pd.Timestamp]:
+    # the latest valid time saved for a lead hour, None if there is none yet
+    latest = read_latest(store)
+    if lead_hour not in latest.index:
+        return None
+    return latest.loc[lead_hour, "valid_time"]
+
+
+@contextlib.contextmanager
+def archive_lock(path: str):
+    # only one process may write to an archive file at a time, compacting holds it while it rewrites the file
+    with open(f"{path}.lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+@contextlib.contextmanager
+def open_archive(
+    location: str, model: str, mode: str = "a", archive_path: str = ARCHIVE_PATH
+) -> typing.Iterator[pd.HDFStore]:
+    path = archive_file(location, model, archive_path)
+    if mode == "r":
+        with pd.HDFStore(path, mode=mode) as store:
+            yield store
+        return
+    os.makedirs(archive_path, exist_ok=True)
+    with archive_lock(path), pd.HDFStore(path, mode=mode) as store:
+        yield store
+
+
+def build_where(
+    lead_hours: typing.Optional[typing.Iterable[int]] = None,
+    start: typing.Optional[typing.Any] = None,
+    end: typing.Optional[typing.Any] = None,
+) -> typing.List[str]:
+    # the conditions are evaluated inside pytables, only matching rows are read
+    where = []
+    if lead_hours is not None:
+        where.append(f"lead_hour in {sorted(int(hour) for hour in lead_hours)}")
+    if start is not None:
+        where.append(f"index >= {pd.Timestamp(start)!r}")
+    if end is not None:
+        where.append(f"index <= {pd.Timestamp(end)!r}")
+    return where
+
+
+def read_forecast(
+    location: str,
+    model: str,
+    lead_hours: typing.Optional[typing.Iterable[int]] = None,
+    start: typing.Optional[typing.Any] = None,
+    end: typing.Optional[typing.Any] = None,
+    columns: typing.Optional[typing.List[str]] = None,
+    archive_path: str = ARCHIVE_PATH,
+) -> pd.DataFrame:
+    path = archive_file(location, model, archive_path)
+    if not os.path.exists(path):
+        return pd.DataFrame()
+    with pd.HDFStore(path, mode="r") as store:
+        if "data" not in store:
+            return pd.DataFrame()
+        return store.select(
+            "data",
+            where=build_where(lead_hours, start, end) or None,
+            columns=columns,
+        )
+
+
+def iter_forecast(
+    location: str,
+    model: str,
+    lead_hours: typing.Optional[typing.Iterable[int]] = None,
+    start: typing.Optional[typing.Any] = None,
+    end: typing.Optional[typing.Any] = None,
+    columns: typing.Optional[typing.List[str]] = None,
+    chunk_rows: int = READ_CHUNK_ROWS,
+    archive_path: str = ARCHIVE_PATH,
+) -> typing.Iterator[pd.DataFrame]:
+    # like read_forecast, but the matching rows come in chunks of at most chunk_rows, so whatever runs over
+    # the whole archive only holds one chunk at a time, the file stays open until the generator is done
+    path = archive_file(location, model, archive_path)
+    if not os.path.exists(path):
+        return
+    with pd.HDFStore(path, mode="r") as store:
+        if "data" not in store:
+            return
+        for chunk in store.select(
+            "data",
+            where=build_where(lead_hours, start, end) or None,
+            columns=columns,
+            chunksize=chunk_rows,
+        ):
+            if not chunk.empty:
+                yield chunk
+
+
+def read_legacy_file(path: str) -> pd.DataFrame:
+    # the old files store valid time and save time as strings
+    with pd.HDFStore(path, mode="r") as store:
+        df = store["data"]
+    df = df.reset_index()
+    df["datetime"] = pd.to_datetime(df["datetime"])
+    df["save_time"] = pd.to_datetime(df["save_time"])
+    return df
+
+
+def migrate(legacy_path: str = LEGACY_PATH, archive_path: str = ARCHIVE_PATH):
+    # copies the {location}_{model}_{lead_hour}.h5 files into the archive, the old files stay as they are
+    os.makedirs(archive_path, exist_ok=True)
+    pattern = re.compile(r"^(?P<location>[a-z]+)_(?P<model>.+)_(?P<lead_hour>\d+)\.h5$")
+    partitions = {}
+    for file_name in sorted(os.listdir(legacy_path)):
+        match = pattern.match(file_name)
+        if match is None:
+            continue
+        key = (match["location"], match["model"])
+        partitions.setdefault(key, []).append(
+            (int(match["lead_hour"]), os.path.join(legacy_path, file_name))
+        )
+    for (location, model), files in sorted(partitions.items()):
+        path = archive_file(location, model, archive_path)
+        if os.path.exists(path):
+            logger.info("Skipping %s %s, %s already exists", location, model, path)
+            continue
+        rows = 0
+        # we write to a temporary file first, so an interrupted migration does not leave half a partition
+        tmp_path = f"{path}.tmp"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        with pd.HDFStore(tmp_path, mode="w") as store:
+            for lead_hour, file_name in sorted(files):
+                # the save times of the old files are kept
+                rows += append_forecast(store, read_legacy_file(file_name), lead_hour)
+            store.create_table_index(
+                "data", columns=["index"] + DATA_COLUMNS, optlevel=9, kind="full"
+            )
+        os.replace(tmp_path, path)
+        logger.info("Migrated %s files with %s rows to %s", len(files), rows, path)
+
+
+def compact_rows(df: pd.DataFrame) -> pd.DataFrame:
+    # a row saved twice (e.g. by a repeated backfill) is kept once, the rows are sorted by valid time,
+    # so reads of a valid time range touch neighbouring chunks of the file
+    df = df.rename_axis("datetime").reset_index()
+    df = df.drop_duplicates(["datetime", "lead_hour", "save_time"], keep="last")
+    df = df.sort_values(["datetime", "lead_hour", "save_time"], kind="stable")
+    return df.set_index("datetime")
+
+
+def write_compacted(
+    store: pd.HDFStore, df: pd.DataFrame, expected_rows: int, complevel: int
+):
+    # expectedrows lets pytables pick large chunks for the whole table instead of ones sized for an hourly append
+    store.append(
+        "data",
+        df,
+        format="table",
+        data_columns=DATA_COLUMNS,
+        complib="blosc",
+        complevel=complevel,
+        expectedrows=max(expected_rows, 1),
+        index=False,
+    )
+
+
+def compact_file(
+    path: str, chunk_days: int = COMPACT_CHUNK_DAYS, complevel: int = 9
+) -> dict:
+    # rewrites one archive file deduplicated, sorted, compressed and indexed, the old file is only replaced
+    # once the new one is complete, readers that still have the old one open keep reading it
+    # hdf5 must not be read while another process writes, so the collector waits for the whole file
+    with archive_lock(path):
+        tmp_path = f"{path}.compact"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        size_before = os.path.getsize(path)
+        with pd.HDFStore(path, mode="r") as source:
+            if "data" not in source:
+                return {"path": path, "skipped": True}
+            rows_before = source.get_storer("data").nrows
+            valid_times = source.select_column("data", "index")
+            if valid_times.empty:
+                return {"path": path, "skipped": True}
+            rows_after = 0
+            with pd.HDFStore(tmp_path, mode="w") as target:
+                # a valid time never spans two windows, so deduplicating per window finds every duplicate
+                window = pd.Timedelta(days=chunk_days)
+                window_start = valid_times.min().floor("D")
+                last_valid_time = valid_times.max()
+                while window_start <= last_valid_time:
+                    df = source.select(
+                        "data",
+                        where=[
+                            f"index >= {window_start!r}",
+                            f"index < {window_start + window!r}",
+                        ],
+                    )
+                    if not df.empty:
+                        df = compact_rows(df)
+                        write_compacted(target, df, rows_before, complevel)
+                        rows_after += len(df)
+                    window_start += window
+                target.create_table_index(
+                    "data", columns=["index"] + DATA_COLUMNS, optlevel=9, kind="full"
+                )
+                write_latest(target, rebuild_latest(target))
+        os.replace(tmp_path, path)
+    return {
+        "path": path,
+        "skipped": False,
+        "rows_before": rows_before,
+        "rows_after": rows_after,
+        "bytes_before": size_before,
+        "bytes_after": os.path.getsize(path),
+    }
+
+
+def compact(
+    archive_path: str = ARCHIVE_PATH,
+    workers: int = COMPACT_WORKERS,
+    chunk_days: int = COMPACT_CHUNK_DAYS,
+    complevel: int = 9,
+) -> typing.List[dict]:
+    # the files are independent, every one is compacted in its own process
+    paths = sorted(
+        os.path.join(archive_path, file_name)
+        for file_name in os.listdir(archive_path)
+        if file_name.endswith(".h5")
+    )
+    results = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(compact_file, path, chunk_days, complevel): path
+            for path in paths
+        }
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                result = future.result()
+            except Exception:
+                # a broken file stays as it is, the others are still compacted
+                logger.exception("Could not compact %s", futures[future])
+                continue
+            results.append(result)
+            if result["skipped"]:
+                logger.info("Skipping %s, it has no data", result["path"])
+                continue
+            logger.info(
+                "Compacted %s: %s -> %s rows, %.1f -> %.1f MB",
+                result["path"],
+                result["rows_before"],
+                result["rows_after"],
+                result["bytes_before"] / 1e6,
+                result["bytes_after"] / 1e6,
+            )
+    return sorted(results, key=lambda result: result["path"])
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Manage the forecast archive")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    migrate_parser = subparsers.add_parser(
+        "migrate", help="Copy the per lead hour files into the archive"
+    )
+    migrate_parser.add_argument(
+        "--legacy_path",
+        type=str,
+        help="Directory with the {location}_{model}_{lead_hour}.h5 files",
+        required=False,
+        default=LEGACY_PATH,
+    )
+    migrate_parser.add_argument(
+        "--archive_path",
+        type=str,
+        help="Directory of the archive",
+        required=False,
+        default=ARCHIVE_PATH,
+    )
+    compact_parser = subparsers.add_parser(
+        "compact",
+        help="Deduplicate, sort, compress and index the archive files",
+    )
+    compact_parser.add_argument(
+        "--archive_path",
+        type=str,
+        help="Directory of the archive",
+        required=False,
+        default=ARCHIVE_PATH,
+    )
+    compact_parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        help="Files compacted at the same time",
+        required=False,
+        default=COMPACT_WORKERS,
+    )
+    compact_parser.add_argument(
+        "--chunk_days",
+        type=int,
+        help="Days of valid time rewritten at a time",
+        required=False,
+        default=COMPACT_CHUNK_DAYS,
+    )
+    compact_parser.add_argument(
+        "--complevel",
+        type=int,
+        choices=range(10),
+        help="Blosc compression level",
+        required=False,
+        default=9,
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    configure()
+    if args.command == "migrate":
+        migrate(args.legacy_path, args.archive_path)
+    elif args.command == "compact":
+        compact(args.archive_path, args.workers, args.chunk_days, args.complevel)
@@ -0,0 +1,153 @@
+# the merged forecast of a spot, every model in one float32 array indexed by (model, variable, time)
+# the observations the models are compared with are kept once next to it, both share one int64 time axis
+# (naive local time in ns), DataFrames are only made when someone asks for one
+
+import typing
+
+import numpy as np
+import pandas as pd
+
+# what we keep of every model
+MODEL_VARIABLES = [
+    "wind_speed_10m",
+    "wind_gusts_10m",
+    "mse_smooth",
+    "wind_dir_U",
+    "wind_dir_V",
+]
+# what we keep of the station and the gauge
+OBSERVATION_VARIABLES = [
+    "waterlevel",
+    "smooth_wind_max",
+    "smooth_wind_min",
+    "smooth_wind_avg",
+]
+
+
+class ForecastCube:
+    def __init__(
+        self,
+        times: typing.Any,
+        models: typing.List[str],
+        values: typing.Optional[np.ndarray] = None,
+        observations: typing.Optional[np.ndarray] = None,
+        is_night: typing.Optional[np.ndarray] = None,
+    ):
+        # times has to be sorted, without values and observations everything starts as nan
+        self.times = np.asarray(times, dtype="datetime64[ns]").view("int64")
+        self.models = list(models)
+        if values is None:
+            values = np.full(
+                (len(self.models), len(MODEL_VARIABLES), len(self.times)),
+                np.nan,
+                dtype="float32",
+            )
+        if observations is None:
+            observations = np.full(
+                (len(OBSERVATION_VARIABLES), len(self.times)), np.nan, dtype="float32"
+            )
+        if is_night is None:
+            is_night = np.zeros(len(self.times), dtype=bool)
+        self.values = values
+        self.observations = observations
+        self.is_night = is_night
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    @property
+    def datetimes(self) -> pd.DatetimeIndex:
+        return pd.DatetimeIndex(self.times.view("datetime64[ns]"), name="datetime")
+
+    def positions(self, times: typing.Any) -> np.ndarray:
+        # where the given times are on the time axis, they all have to be on it
+        times = np.asarray(times, dtype="datetime64[ns]").view("int64")
+        positions = np.searchsorted(self.times, times)
+        if len(times) and (
+            positions.max() >= len(self.times) or (self.times[positions] != times).any()
+        ):
+            raise ValueError("Times that are not on the time axis of the cube")
+        return positions
+
+    def set_model(
+        self, model: str, variable: str, times: typing.Any, values: typing.Any
+    ):
+        self.values[
+            self.models.index(model),
+            MODEL_VARIABLES.index(variable),
+            self.positions(times),
+        ] = np.asarray(values, dtype="float32")
+
+    def set_observation(self, variable: str, times: typing.Any, values: typing.Any):
+        self.observations[
+            OBSERVATION_VARIABLES.index(variable), self.positions(times)
+        ] = np.asarray(values, dtype="float32")
+
+    def update(self, block: "ForecastCube"):
+        # copies the models and the observations of a cube on some of our times into this one
+        positions = self.positions(block.times.view("datetime64[ns]"))
+        for i, model in enumerate(block.models):
+            self.values[self.models.index(model)][:, positions] = block.values[i]
+        self.observations[:, positions] = block.observations
+
+    def model(self, model: str, variable: str) -> np.ndarray:
+        # a view, not a copy
+        return self.values[self.models.index(model), MODEL_VARIABLES.index(variable)]
+
+    def observation(self, variable: str) -> np.ndarray:
+        return self.observations[OBSERVATION_VARIABLES.index(variable)]
+
+    def slice(
+        self, start: int = 0, stop: typing.Optional[int] = None
+    ) -> "ForecastCube":
+        # a cube of the positions start to stop, sharing the arrays of this one
+        return ForecastCube(
+            self.times[start:stop].view("datetime64[ns]"),
+            self.models,
+            self.values[:, :, start:stop],
+            self.observations[:, start:stop],
+            self.is_night[start:stop],
+        )
+
+    def select(
+        self,
+        start: typing.Optional[typing.Any] = None,
+        end: typing.Optional[typing.Any] = None,
+    ) -> "ForecastCube":
+        # the valid times from start to end, both included
+        first = 0
+        last = len(self.times)
+        if start is not None:
+            first = np.searchsorted(self.times, pd.Timestamp(start).as_unit("ns").value)
+        if end is not None:
+            last = np.searchsorted(
+                self.times, pd.Timestamp(end).as_unit("ns").value, side="right"
+            )
+        return self.slice(first, last)
+
+    def model_frame(self, model: str) -> pd.DataFrame:
+        # one column per variable of a model
+        return pd.DataFrame(
+            self.values[self.models.index(model)].T,
+            index=self.datetimes,
+            columns=MODEL_VARIABLES,
+        )
+
+    def variable_frame(self, variable: str) -> pd.DataFrame:
+        # one column per model, e.g. to compare the wind speed of all models
+        return pd.DataFrame(
+            self.values[:, MODEL_VARIABLES.index(variable)].T,
+            index=self.datetimes,
+            columns=self.models,
+        )
+
+    def to_frame(self) -> pd.DataFrame:
+        # the wide layout with a datetime column, the observations and {model}_{variable} columns
+        columns = {"datetime": self.times.view("datetime64[ns]")}
+        for variable in OBSERVATION_VARIABLES:
+            columns[variable] = self.observation(variable)
+        for model in self.models:
+            for variable in MODEL_VARIABLES:
+                columns[f"{model}_{variable}"] = self.model(model, variable)
+        columns["is_night"] = self.is_night
+        return pd.DataFrame(columns)
@@ -0,0 +1,169 @@
+# how the forecast for a valid time changed as it came closer, per model
+# the result is a lead hour x valid time matrix, every cell is the value the model gave that many hours ahead
+# only the rows of the valid time range (and lead hours) and the asked for columns are read from the archive,
+# the models are in separate files, so they can be read in parallel
+
+import argparse
+import concurrent.futures
+import typing
+
+import pandas as pd
+
+from forecastarchive import ARCHIVE_PATH, VALUE_COLUMNS, read_forecast
+from instrumentation import configure
+from spots import MODELS, get_spot
+
+
+def read_evolution(
+    location: str,
+    model: str,
+    start: typing.Any,
+    end: typing.Any,
+    variable: str = "wind_speed_10m",
+    lead_hours: typing.Optional[typing.Iterable[int]] = None,
+    archive_path: str = ARCHIVE_PATH,
+) -> pd.DataFrame:
+    # the rows are the lead hours, the columns the valid times, missing forecasts are nan
+    df = read_forecast(
+        location,
+        model,
+        lead_hours=lead_hours,
+        start=start,
+        end=end,
+        columns=[variable, "lead_hour", "save_time"],
+        archive_path=archive_path,
+    )
+    if df.empty:
+        return pd.DataFrame(
+            index=pd.Index([], dtype="int16", name="lead_hour"),
+            columns=pd.DatetimeIndex([], name="datetime"),
+            dtype="float32",
+        )
+    # a valid time saved twice at the same lead hour (e.g. by a backfill) counts with its latest save
+    df = (
+        df.rename_axis("datetime")
+        .reset_index()
+        .sort_values("save_time", kind="stable")
+        .drop_duplicates(["lead_hour", "datetime"], keep="last")
+    )
+    return df.pivot(index="lead_hour", columns="datetime", values=variable).sort_index()
+
+
+def query_evolution(
+    location: str,
+    models: typing.List[str],
+    start: typing.Any,
+    end: typing.Any,
+    variable: str = "wind_speed_10m",
+    lead_hours: typing.Optional[typing.Iterable[int]] = None,
+    workers: int = 1,
+    archive_path: str = ARCHIVE_PATH,
+) -> typing.Dict[str, pd.DataFrame]:
+    # the matrix of every model, with more than one worker the files are read in separate processes
+    # (pytables must not read from several threads)
+    location = get_spot(location)["name"]
+    lead_hours = None if lead_hours is None else list(lead_hours)
+    args = [
+        (location, model, start, end, variable, lead_hours, archive_path)
+        for model in models
+    ]
+    if workers <= 1 or len(models) <= 1:
+        return {model: read_evolution(*arg) for model, arg in zip(models, args)}
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=min(workers, len(models))
+    ) as executor:
+        futures = {
+            model: executor.submit(read_evolution, *arg)
+            for model, arg in zip(models, args)
+        }
+        return {model: future.result() for model, future in futures.items()}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Show how the forecast for a range of valid times evolved per model"
+    )
+    parser.add_argument(
+        "-l",
+        "--location",
+        type=str,
+        help="Location to show the forecasts for",
+        required=True,
+    )
+    parser.add_argument(
+        "-m",
+        "--models",
+        type=str,
+        nargs="+",
+        choices=list(MODELS),
+        help="Models to show, by default the ones the spot collects",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "-s",
+        "--start",
+        type=str,
+        help="First valid time, e.g. 2024-10-12T14:00",
+        required=True,
+    )
+    parser.add_argument(
+        "-e",
+        "--end",
+        type=str,
+        help="Last valid time, by default the first one",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "-v",
+        "--variable",
+        type=str,
+        choices=VALUE_COLUMNS,
+        help="Forecast variable to show",
+        required=False,
+        default="wind_speed_10m",
+    )
+    parser.add_argument(
+        "--lead_hours",
+        type=int,
+        nargs="+",
+        help="Lead hours to show, by default all",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        help="Processes reading the models at the same time",
+        required=False,
+        default=4,
+    )
+    parser.add_argument(
+        "--archive_path",
+        type=str,
+        help="Directory of the archive",
+        required=False,
+        default=ARCHIVE_PATH,
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    configure()
+    models = args.models or get_spot(args.location)["collect"]
+    evolutions = query_evolution(
+        args.location,
+        models,
+        args.start,
+        args.end or args.start,
+        args.variable,
+        args.lead_hours,
+        args.workers,
+        args.archive_path,
+    )
+    for model, evolution in evolutions.items():
+        print(f"\n{args.variable} of {model} by lead hour")
+        print(evolution.to_string())
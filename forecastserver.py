@@ -0,0 +1,209 @@
+# a small local http service for the merged forecast frames of get_forecast
+# the client session stays open and every frame is kept in memory until a model run or the station data
+# makes it stale, a poller that sends the ETag back gets a 304 without anything being fetched or encoded
+
+import argparse
+import datetime
+import hashlib
+import http.server
+import io
+import json
+import logging
+import threading
+import typing
+import urllib.parse
+
+import pandas as pd
+
+from getforecast import build_forecast
+from instrumentation import configure
+from renderforecast import CHARTS, FORMATS, forecast_version, render_figure
+from saveforecast import get_client
+from spots import get_spot
+
+try:
+    import pyarrow
+except ImportError:
+    # arrow is optional, without it we only serve json
+    pyarrow = None
+
+# the cache of the client must not hide a new model run, the frames are cached in memory anyway
+CACHE_SECONDS = 60
+CONTENT_TYPES = {
+    "json": "application/json",
+    "arrow": "application/vnd.apache.arrow.stream",
+    "png": "image/png",
+    "svg": "image/svg+xml",
+}
+logger = logging.getLogger(__name__)
+
+
+class ForecastCache:
+    # the latest frame per spot and options, an older version is replaced when a newer one is built
+    def __init__(self, openmeteo):
+        self.openmeteo = openmeteo
+        self.frames = {}
+        self.lock = threading.Lock()
+        self.key_locks = {}
+
+    def version(
+        self, location: str, hours_to_show: int, past_hours: int
+    ) -> typing.Tuple[tuple, str]:
+        spot_name, version = forecast_version(
+            location, None, hours_to_show, past_hours, datetime.datetime.now()
+        )
+        key = (spot_name, hours_to_show, past_hours)
+        return key, hashlib.sha1(repr(version).encode()).hexdigest()[:16]
+
+    def get(self, key: tuple, version: str) -> dict:
+        with self.lock:
+            key_lock = self.key_locks.setdefault(key, threading.Lock())
+        # only one request builds a frame, the others for the same spot wait for it
+        with key_lock:
+            cached = self.frames.get(key)
+            if cached is not None and cached[0] == version:
+                return cached[1]
+            spot_name, hours_to_show, past_hours = key
+            forecast = build_forecast(
+                spot_name, None, hours_to_show, past_hours * 4, self.openmeteo
+            )
+            self.frames[key] = (version, forecast)
+            return forecast
+
+
+def encode_frame(models_df: pd.DataFrame, fmt: str) -> bytes:
+    if fmt == "json":
+        return models_df.to_json(orient="records", date_format="iso").encode()
+    table = pyarrow.Table.from_pandas(models_df, preserve_index=False)
+    sink = io.BytesIO()
+    with pyarrow.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue()
+
+
+def parse_valid_time(value: typing.Optional[str]) -> typing.Optional[pd.Timestamp]:
+    # start and end of the query, a missing one leaves that side of the range open
+    if value is None:
+        return None
+    timestamp = pd.Timestamp(value)
+    if pd.isna(timestamp):
+        raise ValueError(f"{value!r} is not a time")
+    return timestamp
+
+
+class ForecastHandler(http.server.BaseHTTPRequestHandler):
+    # GET /forecast/<location>?format=json|arrow&start=...&end=...&hours_to_show=72&past_hours=18
+    # GET /chart/<location>?chart=forecast|mse&format=png|svg&hours_to_show=72&past_hours=18
+    cache: ForecastCache = None
+
+    def send_error_json(self, status: int, message: str):
+        body = json.dumps({"error": message}).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        query = {
+            name: values[-1]
+            for name, values in urllib.parse.parse_qs(url.query).items()
+        }
+        parts = [part for part in url.path.split("/") if part]
+        if len(parts) != 2 or parts[0] not in ["forecast", "chart"]:
+            self.send_error_json(404, "Use /forecast/<location> or /chart/<location>")
+            return
+        kind, location = parts
+        default_format = "json" if kind == "forecast" else "png"
+        fmt = query.get("format", default_format)
+        chart = query.get("chart", "forecast")
+        if kind == "forecast" and fmt not in ["json", "arrow"]:
+            self.send_error_json(400, f"Unknown format {fmt}")
+            return
+        if kind == "forecast" and fmt == "arrow" and pyarrow is None:
+            self.send_error_json(406, "Arrow needs pyarrow, use format=json")
+            return
+        if kind == "chart" and (fmt not in FORMATS or chart not in CHARTS):
+            self.send_error_json(400, f"Unknown chart {chart} or format {fmt}")
+            return
+        try:
+            get_spot(location)
+            hours_to_show = int(query.get("hours_to_show", 72))
+            past_hours = int(query.get("past_hours", 18))
+            start = parse_valid_time(query.get("start"))
+            end = parse_valid_time(query.get("end"))
+        except ValueError as e:
+            self.send_error_json(400, str(e))
+            return
+        key, version = self.cache.version(location, hours_to_show, past_hours)
+        # the body only depends on the version of the frame and the request, so we know the ETag before building
+        etag = hashlib.sha1(
+            repr(
+                (version, kind, fmt, chart, query.get("start"), query.get("end"))
+            ).encode()
+        ).hexdigest()[:16]
+        etag = f'"{etag}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        try:
+            forecast = self.cache.get(key, version)
+            if kind == "forecast":
+                # only the requested valid times become a frame
+                body = encode_frame(
+                    forecast["cube"].select(start, end).to_frame(),
+                    fmt,
+                )
+            else:
+                body = render_figure(forecast, chart, fmt)
+        except Exception as e:
+            self.send_error_json(502, f"Getting the forecast failed: {e}")
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPES[fmt])
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        # clients have to ask again, but with the ETag that costs nothing
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve(host: str = "127.0.0.1", port: int = 8000):
+    ForecastHandler.cache = ForecastCache(get_client(expire_after=CACHE_SECONDS))
+    server = http.server.ThreadingHTTPServer((host, port), ForecastHandler)
+    logger.info("Serving forecasts on http://%s:%s", host, port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Stopped")
+    finally:
+        server.server_close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Serve the merged forecast frames")
+    parser.add_argument(
+        "--host",
+        type=str,
+        help="Address to listen on",
+        required=False,
+        default="127.0.0.1",
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        help="Port to listen on",
+        required=False,
+        default=8000,
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    configure()
+    serve(args.host, args.port)
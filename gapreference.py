@@ -0,0 +1,47 @@
+# the gap repair as get_forecast did it before gaprepair and the gusts to check it on,
+# shared by the tests and the benchmark
+
+import numpy as np
+import pandas as pd
+
+
+def make_gusts(rows, gap_share, seed=0):
+    # gusts with single zeros and clusters of zeros, as icon_d2 returns them for the past
+    rng = np.random.default_rng(seed)
+    gusts = np.abs(rng.normal(18, 6, rows)).astype("float32")
+    gaps = rng.random(rows) < gap_share
+    # every other gap starts a short cluster, so the one by one order matters
+    clusters = np.flatnonzero(gaps)[::2]
+    for width in range(1, 4):
+        gaps[np.minimum(clusters + width, rows - 1)] = True
+    gusts[gaps] = 0
+    return gusts
+
+
+def legacy_repair(gusts):
+    # the loop get_forecast used before gaprepair, kept for comparison
+    df = pd.DataFrame({"wind_gusts_10m": gusts})
+    for i in range(4, len(df["wind_gusts_10m"]) - 4):
+        if df["wind_gusts_10m"][i] == 0:
+            df.loc[i, "wind_gusts_10m"] = (
+                df["wind_gusts_10m"][i - 4] + df["wind_gusts_10m"][i + 4]
+            ) / 2
+            df.loc[i + 2, "wind_gusts_10m"] = (
+                df["wind_gusts_10m"][i] + df["wind_gusts_10m"][i + 4]
+            ) / 2
+            df.loc[i - 2, "wind_gusts_10m"] = (
+                df["wind_gusts_10m"][i] + df["wind_gusts_10m"][i - 4]
+            ) / 2
+            df.loc[i - 1, "wind_gusts_10m"] = (
+                df["wind_gusts_10m"][i] + df["wind_gusts_10m"][i - 2]
+            ) / 2
+            df.loc[i + 1, "wind_gusts_10m"] = (
+                df["wind_gusts_10m"][i] + df["wind_gusts_10m"][i + 2]
+            ) / 2
+            df.loc[i + 3, "wind_gusts_10m"] = (
+                df["wind_gusts_10m"][i + 2] + df["wind_gusts_10m"][i + 4]
+            ) / 2
+            df.loc[i - 3, "wind_gusts_10m"] = (
+                df["wind_gusts_10m"][i - 2] + df["wind_gusts_10m"][i - 4]
+            ) / 2
+    return df["wind_gusts_10m"].to_numpy()
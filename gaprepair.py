@@ -0,0 +1,113 @@
+# repairs single faulty values in model data by interpolating over a window around them
+
+import typing
+
+import numpy as np
+import pandas as pd
+
+# the model variables that need repairing, before and after are the size of the window around a faulty value
+# WARN: the icon_d2 model has faulty data for gusts in the past, they come as 0
+REPAIRS = {
+    "icon_d2": [{"column": "wind_gusts_10m", "before": 4, "after": 4}],
+}
+
+
+def window_steps(
+    before: int, after: int
+) -> typing.List[typing.Tuple[int, int, int, float, float]]:
+    # the (target, left, right, left weight, right weight) offsets to fill the window of a faulty value at 0,
+    # a value is always filled from two values that are already known: first 0 from the window ends,
+    # then every half of the window is split in the middle again, for 4 and 4 that is
+    # 0 from -4 and 4, -2 from -4 and 0, -3 from -4 and -2, -1 from -2 and 0 and the same after 0
+    steps = [(0, -before, after)]
+
+    def split(left, right):
+        if right - left < 2:
+            return
+        middle = (left + right) // 2
+        steps.append((middle, left, right))
+        split(left, middle)
+        split(middle, right)
+
+    split(-before, 0)
+    split(0, after)
+    return [
+        (
+            target,
+            left,
+            right,
+            (right - target) / (right - left),
+            (target - left) / (right - left),
+        )
+        for target, left, right in steps
+    ]
+
+
+def apply_window(values: np.ndarray, hits: np.ndarray, steps: typing.List[tuple]):
+    # fills the windows of all hits at once, the hits must not see each other's windows
+    for target, left, right, left_weight, right_weight in steps:
+        values[hits + target] = (
+            values[hits + left] * left_weight + values[hits + right] * right_weight
+        )
+
+
+def repair_gaps_loop(
+    values: np.ndarray,
+    start: int,
+    before: int = 4,
+    after: int = 4,
+    is_gap: typing.Callable[[np.ndarray], np.ndarray] = lambda values: values == 0,
+):
+    # the plain loop, every faulty value from start on is repaired one after the other in place
+    steps = window_steps(before, after)
+    for i in range(start, len(values) - after):
+        if is_gap(values[i : i + 1])[0]:
+            apply_window(values, np.array([i]), steps)
+
+
+def repair_gaps(
+    values: np.ndarray,
+    before: int = 4,
+    after: int = 4,
+    is_gap: typing.Callable[[np.ndarray], np.ndarray] = lambda values: values == 0,
+) -> np.ndarray:
+    # replaces every value where is_gap is True by interpolating from the values before and after its window,
+    # the result is the same as going through the values one by one, where a repaired window is already
+    # used for the next faulty value, but hits that are far enough apart are repaired all at once
+    values = np.array(values, copy=True)
+    steps = window_steps(before, after)
+    reach = before + after
+    stop = len(values) - after
+    offsets = np.arange(-before + 1, after)
+    position = before
+    while position < stop:
+        hits = np.flatnonzero(is_gap(values[position:stop])) + position
+        if hits.size == 0:
+            break
+        # hits closer than the window reach see each other's writes, we take the leading ones that do not
+        close = np.flatnonzero(np.diff(hits) < reach)
+        batch = hits if close.size == 0 else hits[: close[0] + 1]
+        window = (batch[:, np.newaxis] + offsets).ravel()
+        previous = values[window]
+        apply_window(values, batch, steps)
+        # a filled value behind a hit can be faulty again (e.g. both window ends were), one by one it would
+        # be repaired before the next hit, so from here on we go one by one
+        behind = (batch[:, np.newaxis] + np.arange(1, after)).ravel()
+        if behind.size and is_gap(values[behind]).any():
+            values[window] = previous
+            repair_gaps_loop(values, batch[0], before, after, is_gap)
+            break
+        # the one by one loop goes on right after the last repaired value, the values it filled are checked again
+        position = batch[-1] + 1
+    return values
+
+
+def repair_model(df: pd.DataFrame, model: str) -> pd.DataFrame:
+    # applies the repairs of the model, df needs a plain 0..n index
+    for repair in REPAIRS.get(model, []):
+        df[repair["column"]] = repair_gaps(
+            df[repair["column"]].to_numpy(),
+            before=repair["before"],
+            after=repair["after"],
+        )
+    return df
@@ -1,17 +1,41 @@
 import openmeteo_requests
-import pandas
 
-import requests_cache
 import pandas as pd
 import numpy as np
-from retry_requests import retry
 import matplotlib.pyplot as plt
 import datetime
 import argparse
+import concurrent.futures
+import functools
+import logging
+import os
 
 from getstationdata import get_station_data
-from getwaterlevel import get_waterlevel
+from httpclient import get_session
+from getwaterlevel import get_waterlevels
 from getsun import getsunrise, getsunset
+from asofjoin import align_observations, to_naive_datetime
+from fetchpipeline import fetch_all, SOURCE_TIMEOUTS
+from forecastcube import OBSERVATION_VARIABLES, ForecastCube
+from gaprepair import repair_model
+from instrumentation import LOG_LEVELS, configure, stage
+from omresponse import MINUTELY_15_VARIABLES, decode_minutely_15
+from spots import NUMBERS_TO_MODELS, get_spot
+
+OPENMETEO_URL = "https://api.open-meteo.com/v1/forecast"
+logger = logging.getLogger(__name__)
+FIGURE_SIZE = (30, 10)
+COLORS = [
+    "red",
+    "green",
+    "blue",
+    "orange",
+    "purple",
+    "teal",
+    "pink",
+    "brown",
+    "darkgreen",
+]
 
 # import debugpy
 
@@ -36,56 +60,11 @@ def generate_labels(dates):
     return tick_positions, labels
 
 
-def get_forecast(location, weatherstation, hours_to_show, past_count_of_15_minutes):
-    # Setup the Open-Meteo API client with cache and retry on error
-    print(f"Getting forecast for {location}")
-    cache_session = requests_cache.CachedSession(".cache", expire_after=3600)
-    retry_session = retry(cache_session, retries=5, backoff_factor=0.2)
-    openmeteo = openmeteo_requests.Client(session=retry_session)
-
-    models = [
-        "arome_france_hd",
-        "icon_d2",
-        "metno_seamless",
-        "dmi_harmonie_arome_europe",
-        # "knmi_harmonie_arome_netherlands",
-        # "ukmo_uk_deterministic_2km",
-    ]
-    # models = ["arome_france_hd", "icon_d2", "metno_seamless"]
-    # parse the location
-    # match anything starting with wack to a specific location
-    if location.lower().startswith("wac") or location.lower().startswith("wak"):
-        latitude = 54.75455
-        longitude = 9.87333
-        waterlevel = "22b7dcb3-8c42-4f71-9191-49143ba3a828"  # kalkgrund
-    elif location.lower().startswith("sch"):
-        latitude = 54.86288
-        longitude = 9.56499
-        waterlevel = "22b7dcb3-8c42-4f71-9191-49143ba3a828"  # kalkgrund
-    elif location.lower().startswith("fal"):
-        latitude = 54.77019
-        longitude = 9.965711
-        waterlevel = "22b7dcb3-8c42-4f71-9191-49143ba3a828"  # kalkgrund
-    elif location.lower().startswith("ohr"):
-        latitude = 54.760344
-        longitude = 9.837195
-        waterlevel = "22b7dcb3-8c42-4f71-9191-49143ba3a828"  # kalkgrund
-    elif location.lower().startswith("maas"):
-        latitude = 54.683032
-        longitude = 10.001216
-        waterlevel = "b09f2243-60f0-469a-8f3b-0ea6abc83267"  # kappeln
-    elif location.lower().startswith("rom"):
-        latitude = 55.154645
-        longitude = 8.474347
-        waterlevel = "5e92d73f-e4ea-42c1-9f98-91536c17cdff"  # Römö
-    else:
-        raise ValueError("Location not supported")
-
+def forecast_params(spot, hours_to_show, past_count_of_15_minutes):
     # Make sure all required weather variables are listed here
-    url = "https://api.open-meteo.com/v1/forecast"
-    params = {
-        "latitude": latitude,
-        "longitude": longitude,
+    return {
+        "latitude": spot["latitude"],
+        "longitude": spot["longitude"],
         # "hourly": [
         #     "apparent_temperature",
         #     "precipitation",
@@ -107,320 +86,416 @@ def get_forecast(location, weatherstation, hours_to_show, past_count_of_15_minut
         "forecast_minutely_15": hours_to_show * 4,
         "timeformat": "unixtime",
         "timezone": "Europe/Berlin",
-        "models": models,
+        "models": spot["models"],
         # "models": ["icon_d2"],
     }
-    numbers_to_models = {
-        11: "arome_france_hd",  # 1.5km, quarter hourly, every hour updated
-        75: "metno_seamless",  # 1km, hourly, every hour updated
-        23: "icon_d2",  # 2kn, hourly, every hour updated
-        74: "dmi_harmonie_arome_europe",  # 2km, hourly, every 3 hours updated
-        72: "knmi_harmonie_arome_netherlands",  # 2km, hourly, every hour updated
-        81: "ukmo_uk_deterministic_2km",  # 2km, hourly, every hour updated
-    }
-    responses = openmeteo.weather_api(url, params=params)
-    print(responses)
 
-    mse_df = pd.DataFrame()
-    models_df = pd.DataFrame()
-    now = datetime.datetime.now()
-    # yesterday = now - datetime.timedelta(days=1)
-    from_time = now - datetime.timedelta(minutes=past_count_of_15_minutes * 15)
-    station_data = get_station_data(weatherstation, from_time, now, sliding_window=15)
-    print("got station data")
-    # print(station_data)
-    waterlevels = get_waterlevel(waterlevel)
-    # convert the waterlevels to a dataframe
-    waterlevels_df = pd.DataFrame(waterlevels)
-    # rename timestamp to datetime
-    waterlevels_df["roundedtimestamp"] = pd.to_datetime(
-        waterlevels_df["timestamp"], utc=True
-    ).dt.ceil("15min")
-    waterlevels_df["roundedtimestamp"] = waterlevels_df["roundedtimestamp"].dt.strftime(
-        "%Y-%m-%dT%H:%M:%S"
-    )
-    waterlevels_df["datetime"] = pd.to_datetime(waterlevels_df["roundedtimestamp"])
-    waterlevels_df = waterlevels_df.drop_duplicates(subset=["datetime"], keep="last")
-    # make unique, keep the last occurence
-    waterlevels_df.set_index("datetime", inplace=True)
-    # we need to round the index UP to the next 15 minutes
-    # combine the two dataframes, we need to match the time, if the station data is missing, use the last value before the time being processed
-    # correct station_data datetime to be in the same timezone as df
-    station_data["datetime"] = pd.to_datetime(station_data["datetime"])
-    station_data.set_index("datetime", inplace=False)
-    # Process first location. Add a for-loop for multiple locations or weather models
+
+def decode_models(responses, variables):
+    # the frames of every model by name, indexed by the valid time
+    numbers_to_models = NUMBERS_TO_MODELS
+    model_frames = {}
     for response in responses:
-        print(f"\nModel {numbers_to_models[response.Model()]}")
+        logger.debug("Model %s", numbers_to_models[response.Model()])
         # print(f"Coordinates {response.Latitude()}°N {response.Longitude()}°E")
         # print(f"Elevation {response.Elevation()} m asl")
         # print(f"Current {response.Current()}")
         # print(f"Daily {response.Daily()}")
 
-        minutely_15 = response.Minutely15()
-        if minutely_15:
-            minutely_15_apparent_temperature = minutely_15.Variables(0).ValuesAsNumpy()
-            minutely_15_precipitation = minutely_15.Variables(1).ValuesAsNumpy()
-            minutely_15_wind_speed_10m = minutely_15.Variables(2).ValuesAsNumpy()
-            minutely_15_wind_direction_10m = minutely_15.Variables(3).ValuesAsNumpy()
-            minutely_15_wind_gusts_10m = minutely_15.Variables(4).ValuesAsNumpy()
-
-            minutely_15_data = {
-                "date": pd.date_range(
-                    start=pd.to_datetime(minutely_15.Time(), unit="s", utc=True),
-                    end=pd.to_datetime(minutely_15.TimeEnd(), unit="s", utc=True),
-                    freq=pd.Timedelta(seconds=minutely_15.Interval()),
-                    inclusive="left",
-                )
-            }
-            minutely_15_data["wind_speed_10m"] = minutely_15_wind_speed_10m
-            minutely_15_data["wind_gusts_10m"] = minutely_15_wind_gusts_10m
-            minutely_15_data["wind_direction_10m"] = minutely_15_wind_direction_10m
-            minutely_15_data["apparent_temperature"] = minutely_15_apparent_temperature
-            minutely_15_data["precipitation"] = minutely_15_precipitation
-
-            df = pd.DataFrame(data=minutely_15_data)
+        # the valid times come in local time (the timezone of the request) straight from the response
+        df = decode_minutely_15(response, variables)
+        if df is not None:
             # if we have wind_gusts_10m of 0 and wind_speed_10m of not 0, we need to set wind_gusts_10m to the previous value
             # print(df.to_string())
             # df_mask = df["wind_gusts_10m"] == 0
             # df["wind_gusts_10m"] = df["wind_gusts_10m"].mask(
             #     df_mask, df["wind_gusts_10m"].ffill()
             # )
-
-            # we need to correct the date and time to the correct timezone
-            df["date"] = df["date"] + pd.Timedelta(seconds=response.UtcOffsetSeconds())
-
-            # convert the date to iso format
-            df["date"] = df["date"].dt.strftime("%Y-%m-%dT%H:%M:%S")
-            df["datetime"] = pd.to_datetime(df["date"])
-            timezone = df["datetime"].dt.tz
             df["date"] = df["datetime"].dt.date
             df["time"] = df["datetime"].dt.time
 
             # print(df.to_string())
             # df.to_csv(f"{numbers_to_models[response.Model()]}_minutely_15.csv")
 
-            # get the station data
-            # TODO: better to get the station data indexed to quater hourly already
             df.set_index("datetime", inplace=True)
-            station_data["datetime"] = station_data["datetime"].dt.tz_localize(timezone)
-            station_data_reindexed = station_data.reindex(df.index, method=None)
-            pandas.set_option("future.no_silent_downcasting", True)
-            station_data_reindexed.replace(pd.NA, np.nan, inplace=True)
-            waterlevels_reindexed = waterlevels_df.reindex(df.index, method=None)
-            waterlevels_reindexed = waterlevels_reindexed.rename(
-                columns={"value": "waterlevel"}
-            )
-            # waterlevel substract 500 to get the height in cm
-            waterlevels_reindexed["waterlevel"] = (
-                waterlevels_reindexed["waterlevel"] - 500
-            )
-            waterlevels_reindexed["waterlevel"] = (
-                waterlevels_reindexed["waterlevel"] / 10
-            )
-            # where we have no measurements, get the closest measurement from station_data, but only if the measurement is not older than the previous datetime in station_data_reindexed
-            new_station_data = pd.DataFrame(columns=station_data_reindexed.columns)
-
-            for idx, row in station_data_reindexed.iterrows():
-                if pd.isna(row["wind_avg"]):
-                    this_datetime = row.name
-                    # get the last datetime in station_data that is older than this datetime
-                    station_data_row = (
-                        station_data.loc[station_data["datetime"] < this_datetime]
-                        .sort_values(by="datetime")
-                        .tail(1)
-                    )
-                    if station_data_row.empty:
-                        df.drop(idx, inplace=True)
-                        station_data_reindexed.drop(idx, inplace=True)
-                        continue
-                    if this_datetime > now:
-                        # add a nan to the dataframe
-                        new_station_data.loc[idx, "smooth_wind_avg"] = np.nan
-                        new_station_data.loc[idx, "smooth_wind_min"] = np.nan
-                        new_station_data.loc[idx, "smooth_wind_max"] = np.nan
-                        continue
-                    time_difference = (
-                        this_datetime - station_data_row.iloc[0]["datetime"]
-                    )
-                    # if it is more than 15 minutes old
-                    # if time_difference > pd.Timedelta(minutes=15):
-                    #     new_station_data.loc[idx, "smooth_wind_avg"] = np.nan
-                    #     new_station_data.loc[idx, "smooth_wind_min"] = np.nan
-                    #     new_station_data.loc[idx, "smooth_wind_max"] = np.nan
-                    #     # print(f"Dropping {idx}")
-                    #     # df.drop(idx, inplace=True)
-                    #     continue
-                    row = station_data_row.iloc[0]
-                    # add the row to the dataframe
-                    new_station_data.loc[idx] = row
-            station_data_reindexed = new_station_data
-
-            df = df.join(station_data_reindexed["smooth_wind_avg"])
-            df = df.join(station_data_reindexed["smooth_wind_min"])
-            df = df.join(station_data_reindexed["smooth_wind_max"])
-            df = df.join(waterlevels_reindexed["waterlevel"])
-            print("data joined")
-            print(df)
-            df.reset_index(inplace=True)
-            print("data reset")
-            print(df)
-            # print(df.to_string())
-            # WARN: the icon_d2 model has faulty data for gusts in the past, so we need to correct it
-            if numbers_to_models[response.Model()] == "icon_d2":
-                # if we find a 0 wind speed, we need to correct the wind gusts, total 7 points, 3 before and 3 after
-                for i in range(4, len(df["wind_speed_10m"]) - 4):
-                    if df["wind_gusts_10m"][i] == 0:
-                        df.loc[i, "wind_gusts_10m"] = (
-                            df["wind_gusts_10m"][i - 4] + df["wind_gusts_10m"][i + 4]
-                        ) / 2
-                        df.loc[i + 2, "wind_gusts_10m"] = (
-                            df["wind_gusts_10m"][i] + df["wind_gusts_10m"][i + 4]
-                        ) / 2
-                        df.loc[i - 2, "wind_gusts_10m"] = (
-                            df["wind_gusts_10m"][i] + df["wind_gusts_10m"][i - 4]
-                        ) / 2
-                        df.loc[i - 1, "wind_gusts_10m"] = (
-                            df["wind_gusts_10m"][i] + df["wind_gusts_10m"][i - 2]
-                        ) / 2
-                        df.loc[i + 1, "wind_gusts_10m"] = (
-                            df["wind_gusts_10m"][i] + df["wind_gusts_10m"][i + 2]
-                        ) / 2
-                        df.loc[i + 3, "wind_gusts_10m"] = (
-                            df["wind_gusts_10m"][i + 2] + df["wind_gusts_10m"][i + 4]
-                        ) / 2
-                        df.loc[i - 3, "wind_gusts_10m"] = (
-                            df["wind_gusts_10m"][i - 2] + df["wind_gusts_10m"][i - 4]
-                        ) / 2
-
-            if mse_df.empty:
-                mse_df["datetime"] = df["datetime"]
-                mse_df["date"] = df["date"]
-                mse_df["time"] = df["time"]
-            mse_df["wind_speed_10m"] = df["wind_speed_10m"]
-            mse_df["smooth_wind_avg"] = df["smooth_wind_avg"]
-            mse_df["wind_gusts_10m"] = df["wind_gusts_10m"]
-            mse_df["smooth_wind_max"] = df["smooth_wind_max"]
-
-            # calculate the mean squared error
-            mse_df = mse_df[mse_df["smooth_wind_avg"].notna()]
-            mse_df[f"mse_wind_{numbers_to_models[response.Model()]}"] = (
-                mse_df["wind_speed_10m"] - mse_df["smooth_wind_avg"]
-            ) ** 2
-            mse_df[f"mse_wind_gusts_{numbers_to_models[response.Model()]}"] = (
-                mse_df["wind_gusts_10m"] - mse_df["smooth_wind_max"]
-            ) ** 2
-            mse_df[f"mse_{numbers_to_models[response.Model()]}"] = (
-                mse_df[f"mse_wind_{numbers_to_models[response.Model()]}"]
-                # + mse_df[f"mse_wind_gusts_{numbers_to_models[response.Model()]}"]
-            )
-            # smooth over the last 10 data points
-            mse_df[f"mse_smooth_{numbers_to_models[response.Model()]}"] = (
-                mse_df[f"mse_{numbers_to_models[response.Model()]}"]
-                .rolling(10, min_periods=1)
-                .mean()
-            )
-
-            if not models_df.empty:
-                # check that we have the same number of rows
-                if len(models_df) > len(df):
-                    # check the first datetime
-                    if models_df["datetime"].iloc[0] != df["datetime"].iloc[0]:
-                        # if the first datetime is different, we need to prepend an empty row to df
-                        na_row = pd.DataFrame(
-                            [[pd.NA] * len(df.columns)], columns=df.columns
-                        )
-                        na_row["datetime"] = models_df["datetime"].iloc[0]
-                        df = pd.concat([na_row, df])
-
-            models_df["datetime"] = df["datetime"]
-            models_df["waterlevel"] = df["waterlevel"]
-            models_df[f"{numbers_to_models[response.Model()]}_wind_speed_10m"] = df[
-                "wind_speed_10m"
-            ]
-            models_df[f"{numbers_to_models[response.Model()]}_wind_gusts_10m"] = df[
-                "wind_gusts_10m"
-            ]
-            models_df["smooth_wind_max"] = df["smooth_wind_max"]
-            models_df["smooth_wind_min"] = df["smooth_wind_min"]
-            models_df["smooth_wind_avg"] = df["smooth_wind_avg"]
-            models_df[f"{numbers_to_models[response.Model()]}_mse_smooth"] = mse_df[
-                f"mse_smooth_{numbers_to_models[response.Model()]}"
-            ]
-
-            models_df[f"{numbers_to_models[response.Model()]}_wind_dir_U"] = [
-                -np.sin(np.deg2rad(x)) for x in df["wind_direction_10m"]
-            ]
-            models_df[f"{numbers_to_models[response.Model()]}_wind_dir_V"] = [
-                -np.cos(np.deg2rad(x)) for x in df["wind_direction_10m"]
-            ]
+            model_frames[numbers_to_models[response.Model()]] = df
+    return model_frames
+
+
+def join_observations(df, observations):
+    # the observations at the valid times of one model, the valid time goes back into a column
+    model_observations = observations.reindex(df.index)
+    # where we have no earlier measurement at all we drop the row
+    df = df[model_observations["has_station_data"].to_numpy(dtype=bool)]
+    df = df.join(
+        model_observations[
+            ["smooth_wind_avg", "smooth_wind_min", "smooth_wind_max", "waterlevel"]
+        ]
+    )
+    logger.debug("data joined\n%s", df)
+    df.reset_index(inplace=True)
+    logger.debug("data reset\n%s", df)
+    # print(df.to_string())
+    return df
+
+
+def score_model(mse_df, df, model):
+    # adds the squared errors of one model to mse_df, rows without station data are dropped
+    if mse_df.empty:
+        mse_df["datetime"] = df["datetime"]
+        mse_df["date"] = df["date"]
+        mse_df["time"] = df["time"]
+    mse_df["wind_speed_10m"] = df["wind_speed_10m"]
+    mse_df["smooth_wind_avg"] = df["smooth_wind_avg"]
+    mse_df["wind_gusts_10m"] = df["wind_gusts_10m"]
+    mse_df["smooth_wind_max"] = df["smooth_wind_max"]
+
+    # calculate the mean squared error
+    mse_df = mse_df[mse_df["smooth_wind_avg"].notna()]
+    mse_df[f"mse_wind_{model}"] = (
+        mse_df["wind_speed_10m"] - mse_df["smooth_wind_avg"]
+    ) ** 2
+    mse_df[f"mse_wind_gusts_{model}"] = (
+        mse_df["wind_gusts_10m"] - mse_df["smooth_wind_max"]
+    ) ** 2
+    mse_df[f"mse_{model}"] = (
+        mse_df[f"mse_wind_{model}"]
+        # + mse_df[f"mse_wind_gusts_{model}"]
+    )
+    # smooth over the last 10 data points
+    mse_df[f"mse_smooth_{model}"] = (
+        mse_df[f"mse_{model}"].rolling(10, min_periods=1).mean()
+    )
+    return mse_df
+
+
+def round_waterlevels(waterlevels):
+    # the water levels on the 15 minute grid, in a frame with a value column
+    if waterlevels is None:
+        waterlevels = pd.Series(dtype="float64", index=pd.DatetimeIndex([], tz="UTC"))
+    # we need to round the index UP to the next 15 minutes, the measurements are in utc
+    waterlevels_df = pd.DataFrame(
+        {"value": waterlevels.to_numpy(dtype="float64")},
+        index=pd.DatetimeIndex(
+            waterlevels.index.ceil("15min").tz_convert(None), name="datetime"
+        ),
+    )
+    # make unique, keep the last occurence
+    return waterlevels_df[~waterlevels_df.index.duplicated(keep="last")]
+
+
+def process_model(location, model, df, observations):
+    # everything we do per model, it only depends on its arguments, so it can run in any process
+    # returns the model on its own valid times as a cube of one model and its total mse
+    with stage("join", location=location, model=model, rows=len(df)):
+        df = join_observations(df, observations)
+    # WARN: some models have faulty data in the past (e.g. icon_d2 gusts come as 0), so we need to correct it
+    with stage("repair", location=location, model=model, rows=len(df)):
+        df = repair_model(df, model)
+    with stage("mse", location=location, model=model, rows=len(df)):
+        mse_df = score_model(pd.DataFrame(), df, model)
+
+    block = ForecastCube(df["datetime"], [model])
+    block.set_model(model, "wind_speed_10m", df["datetime"], df["wind_speed_10m"])
+    block.set_model(model, "wind_gusts_10m", df["datetime"], df["wind_gusts_10m"])
+    mse_smooth = mse_df[f"mse_smooth_{model}"]
+    block.set_model(
+        model, "mse_smooth", df.loc[mse_smooth.index, "datetime"], mse_smooth
+    )
+    direction = np.deg2rad(df["wind_direction_10m"].to_numpy(dtype="float64"))
+    block.set_model(model, "wind_dir_U", df["datetime"], -np.sin(direction))
+    block.set_model(model, "wind_dir_V", df["datetime"], -np.cos(direction))
+    for variable in OBSERVATION_VARIABLES:
+        block.set_observation(variable, df["datetime"], df[variable])
     # cap the mse at 20
-    for i, model in enumerate(models):
-        total_mse = mse_df[f"mse_{model}"].clip(upper=20).sum()
-        print(f"Total MSE for {model}: {total_mse}")
+    return block, mse_df[f"mse_{model}"].clip(upper=20).sum()
+
+
+def merge_forecast(
+    location,
+    models,
+    responses,
+    station_data,
+    waterlevels,
+    now,
+    variables=MINUTELY_15_VARIABLES,
+    model_workers=1,
+):
+    # everything after the fetch, it only works on the fetched data, so recorded data can be merged the same way
+    # with more than one model worker (0 or None for every core) the models are processed in a process pool
+    waterlevels_df = round_waterlevels(waterlevels)
+    # combine the two dataframes, we need to match the time, if the station data is missing, use the last value before the time being processed
+    # correct station_data datetime to be in the same timezone as df
+    if not station_data.empty:
+        station_data["datetime"] = to_naive_datetime(station_data["datetime"])
+    # we decode every model first, so the observations only need to be aligned once for all of them
+    with stage("decode", location=location) as record:
+        model_frames = decode_models(responses, variables)
+        record["rows"] = sum(len(df) for df in model_frames.values())
+
+    # all models share the 15 minute grid, we align the station and water level data to the union once
+    grid = pd.DatetimeIndex([])
+    for df in model_frames.values():
+        grid = grid.union(df.index)
+    with stage("align", location=location, rows=len(grid)):
+        observations = align_observations(
+            grid, station_data, waterlevels_df, now, allow_exact_matches=True
+        )
+
+    # the rows of a model are the ones with station data, so every model fits on the grid times that have it
+    times = grid[observations["has_station_data"].to_numpy(dtype=bool)]
+    cube = ForecastCube(times, list(model_frames))
+    # the models only share the observations, so they are processed on their own and merged in model order
+    args = [(location, model, df, observations) for model, df in model_frames.items()]
+    model_workers = model_workers or os.cpu_count() or 1
+    if model_workers <= 1 or len(args) <= 1:
+        results = [process_model(*arg) for arg in args]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=min(model_workers, len(args))
+        ) as executor:
+            results = list(executor.map(process_model, *zip(*args)))
+    for model, (block, total_mse) in zip(model_frames, results):
+        # a model that starts later than the others stays nan at the start
+        cube.update(block)
+        logger.info("Total MSE for %s: %s", model, total_mse)
     # plot the mean squared error
     # print(models_df.to_string())
     # get sunrise and sunset times
-    sunrise = getsunrise("Flensburg", models_df["datetime"].iloc[0]).replace(
-        tzinfo=None
-    )
-    sunset = getsunset("Flensburg", models_df["datetime"].iloc[0]).replace(tzinfo=None)
+    datetimes = cube.datetimes
+    sunrise = getsunrise("Flensburg", datetimes[0]).replace(tzinfo=None)
+    sunset = getsunset("Flensburg", datetimes[0]).replace(tzinfo=None)
     sunrise_time_of_day = sunrise.time()
     sunset_time_of_day = sunset.time()
-    sunset = getsunset("Flensburg", models_df["datetime"].iloc[0]).replace(tzinfo=None)
-    print(f"Sunrise: {sunrise}")
-    print(f"Sunset: {sunset}")
-    print("models_df")
-    print(models_df)
+    logger.debug("Sunrise: %s", sunrise)
+    logger.debug("Sunset: %s", sunset)
     # we drop the first rows if they are not on the full hour
-    while models_df["datetime"].iloc[0].minute != 0:
-        # drop the first row
-        models_df.drop(models_df.index[0], inplace=True)
-    print("dropped first rows")
-    print(models_df)
-    plt.figure(figsize=(30, 10))
-    colors = [
-        "red",
-        "green",
-        "blue",
-        "orange",
-        "purple",
-        "teal",
-        "pink",
-        "brown",
-        "darkgreen",
-    ]
-    # add a column with a boolean value, if the time is between sunrise and sunset, the value is True
-    models_df["is_night"] = models_df["datetime"].apply(
-        lambda x: (
-            True
-            if x.time() < sunrise_time_of_day or x.time() > sunset_time_of_day
-            else False
-        )
+    cube = cube.slice(int(np.argmax(datetimes.minute == 0)))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("models_df\n%s", cube.to_frame())
+    # the night is before sunrise and after sunset
+    datetimes = cube.datetimes
+    time_of_day = datetimes - datetimes.normalize()
+    cube.is_night[:] = (time_of_day < pd.Timedelta(sunrise_time_of_day.isoformat())) | (
+        time_of_day > pd.Timedelta(sunset_time_of_day.isoformat())
     )
+    # everything the charts need, drawing them does not fetch anything
+    return {
+        "location": location,
+        "models": models,
+        "cube": cube,
+    }
+
+
+def build_forecast(
+    location,
+    weatherstation,
+    hours_to_show,
+    past_count_of_15_minutes,
+    openmeteo=None,
+    model_workers=1,
+):
+    logger.info("Getting forecast for %s", location)
+    if openmeteo is None:
+        # Setup the Open-Meteo API client with the shared session, it caches and retries on error
+        openmeteo = openmeteo_requests.Client(session=get_session())
+
+    spot = get_spot(location)
+    waterlevel = spot["waterlevel"]
+    models = spot["models"]
+    if weatherstation is None:
+        weatherstation = spot["station"]
+
+    url = OPENMETEO_URL
+    params = forecast_params(spot, hours_to_show, past_count_of_15_minutes)
+    now = datetime.datetime.now()
+    # yesterday = now - datetime.timedelta(days=1)
+    from_time = now - datetime.timedelta(minutes=past_count_of_15_minutes * 15)
+    # the forecast, the station and the water level are fetched at the same time
+    # the station data comes already bucketed to the 15 minute forecast grid
+    with stage("fetch", location=location) as record:
+        results, errors = fetch_all(
+            {
+                "forecast": (
+                    functools.partial(
+                        openmeteo.weather_api, timeout=SOURCE_TIMEOUTS["forecast"]
+                    ),
+                    (url, params),
+                    SOURCE_TIMEOUTS["forecast"],
+                ),
+                "station": (
+                    functools.partial(
+                        get_station_data,
+                        grid_freq="15min",
+                        timeout=SOURCE_TIMEOUTS["station"],
+                    ),
+                    (weatherstation, from_time, now),
+                    SOURCE_TIMEOUTS["station"],
+                ),
+                "waterlevel": (
+                    get_waterlevels,
+                    (waterlevel, from_time, now, SOURCE_TIMEOUTS["waterlevel"]),
+                    SOURCE_TIMEOUTS["waterlevel"],
+                ),
+            }
+        )
+        record["errors"] = sorted(errors)
+    # without the forecast there is nothing to show, the measurements are optional
+    if "forecast" in errors:
+        raise errors["forecast"]
+    responses = results["forecast"]
+    logger.debug("%s", responses)
+    station_data = results.get("station", pd.DataFrame())
+    logger.debug("got station data")
+    # print(station_data)
+    waterlevels = results.get("waterlevel")
+    with stage("merge", location=location) as record:
+        forecast = merge_forecast(
+            location,
+            models,
+            responses,
+            station_data,
+            waterlevels,
+            now,
+            params["minutely_15"],
+            model_workers,
+        )
+        record["rows"] = len(forecast["cube"])
+    return forecast
+
+
+def build_forecasts(
+    pairs, hours_to_show, past_count_of_15_minutes, openmeteo=None, max_workers=None
+):
+    # pairs are (location, weatherstation), without a weatherstation the one of the spot is used, the
+    # forecasts come back keyed by (spot name, weatherstation), so a spot can be compared with several stations
+    # spots with the same models share one open-meteo request, a station or a gauge is fetched once for all
+    # spots that use it, only the merges run per pair, each in its own process
+    if openmeteo is None:
+        openmeteo = openmeteo_requests.Client(session=get_session())
+    spots = {}
+    requested = []
+    for location, weatherstation in pairs:
+        spot = get_spot(location)
+        spots[spot["name"]] = spot
+        key = (spot["name"], weatherstation or spot["station"])
+        if key not in requested:
+            requested.append(key)
+    logger.info("Getting forecasts for %s", requested)
+    spots_by_models = {}
+    for spot in spots.values():
+        spots_by_models.setdefault(tuple(spot["models"]), []).append(spot)
+
+    now = datetime.datetime.now()
+    from_time = now - datetime.timedelta(minutes=past_count_of_15_minutes * 15)
+    jobs = {}
+    variables = {}
+    for models, group in spots_by_models.items():
+        # open-meteo takes lists of coordinates, LocationId of a response is the position in them
+        params = forecast_params(group[0], hours_to_show, past_count_of_15_minutes)
+        params["latitude"] = [spot["latitude"] for spot in group]
+        params["longitude"] = [spot["longitude"] for spot in group]
+        variables[models] = params["minutely_15"]
+        jobs[("forecast", models)] = (
+            functools.partial(
+                openmeteo.weather_api, timeout=SOURCE_TIMEOUTS["forecast"]
+            ),
+            (OPENMETEO_URL, params),
+            SOURCE_TIMEOUTS["forecast"],
+        )
+    for location, weatherstation in requested:
+        jobs[("station", weatherstation)] = (
+            functools.partial(
+                get_station_data,
+                grid_freq="15min",
+                timeout=SOURCE_TIMEOUTS["station"],
+            ),
+            (weatherstation, from_time, now),
+            SOURCE_TIMEOUTS["station"],
+        )
+    for spot in spots.values():
+        jobs[("waterlevel", spot["waterlevel"])] = (
+            get_waterlevels,
+            (spot["waterlevel"], from_time, now, SOURCE_TIMEOUTS["waterlevel"]),
+            SOURCE_TIMEOUTS["waterlevel"],
+        )
+    with stage("fetch", locations=requested, requests=len(jobs)) as record:
+        results, errors = fetch_all(jobs)
+        record["errors"] = sorted(str(key) for key in errors)
+
+    merges = {}
+    for location, weatherstation in requested:
+        spot = spots[location]
+        models = tuple(spot["models"])
+        # a spot without its forecast is left out, the measurements are optional
+        if ("forecast", models) in errors:
+            continue
+        position = spots_by_models[models].index(spot)
+        merges[(location, weatherstation)] = (
+            location,
+            list(models),
+            [
+                response
+                for response in results[("forecast", models)]
+                if response.LocationId() == position
+            ],
+            # merge_forecast changes the station data, every pair gets its own copy
+            results.get(("station", weatherstation), pd.DataFrame()).copy(),
+            results.get(("waterlevel", spot["waterlevel"])),
+            now,
+            variables[models],
+        )
+    forecasts = {}
+    if not merges:
+        return forecasts
+    with stage("merge", locations=list(merges)) as record:
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=max_workers
+        ) as executor:
+            futures = {
+                key: executor.submit(merge_forecast, *args)
+                for key, args in merges.items()
+            }
+            for key, future in futures.items():
+                try:
+                    forecasts[key] = future.result()
+                except Exception as e:
+                    logger.warning("Merging %s failed: %s", key, e)
+        record["rows"] = sum(len(forecast["cube"]) for forecast in forecasts.values())
+    return forecasts
+
+
+def draw_forecast(ax, forecast):
+    # the wind chart, ax can belong to a pyplot figure or to a headless one
+    models = forecast["models"]
+    cube = forecast["cube"]
+    datetimes = cube.datetimes
+    location = forecast["location"]
+    colors = COLORS
     # print(models_df)
     # shade the night
-    plt.fill_between(
-        models_df["datetime"],
-        plt.ylim()[0],
-        models_df["smooth_wind_max"].max(),
-        where=models_df["is_night"],
+    ax.fill_between(
+        datetimes,
+        ax.get_ylim()[0],
+        np.nanmax(cube.observation("smooth_wind_max")),
+        where=cube.is_night,
         color="gray",
         alpha=0.2,
     )
 
     # colors = ["lightskyblue", "limegreen", "orange"]
-    tick_positions, tick_labels = generate_labels(models_df["datetime"][::4])
+    tick_positions, tick_labels = generate_labels(datetimes[::4])
     for i, model in enumerate(models):
-        plt.plot(
-            models_df["datetime"],
-            models_df[f"{model}_wind_speed_10m"],
+        ax.plot(
+            datetimes,
+            cube.model(model, "wind_speed_10m"),
             label=f"{model}",
             linestyle="solid",
             color=colors[i],
         )
-        plt.plot(
-            models_df["datetime"],
-            models_df[f"{model}_wind_gusts_10m"],
+        ax.plot(
+            datetimes,
+            cube.model(model, "wind_gusts_10m"),
             linestyle="dashed",
             color=colors[i],
         )
@@ -430,11 +505,11 @@ def get_forecast(location, weatherstation, hours_to_show, past_count_of_15_minut
         #     linestyle="dotted",
         #     color=colors[i],
         # )
-        plt.quiver(
-            models_df["datetime"][::4],
-            np.zeros(len(models_df["datetime"][::4])),
-            models_df[f"{model}_wind_dir_U"][::4],
-            models_df[f"{model}_wind_dir_V"][::4],
+        ax.quiver(
+            datetimes[::4],
+            np.zeros(len(datetimes[::4])),
+            cube.model(model, "wind_dir_U")[::4],
+            cube.model(model, "wind_dir_V")[::4],
             units="width",
             width=0.0015,
             pivot="mid",
@@ -443,52 +518,58 @@ def get_forecast(location, weatherstation, hours_to_show, past_count_of_15_minut
             headwidth=5,
             color=colors[i],
         )
-    plt.plot(
-        models_df["datetime"],
-        models_df["smooth_wind_avg"],
+    ax.plot(
+        datetimes,
+        cube.observation("smooth_wind_avg"),
         label="Avg",
         linestyle="solid",
         color="gray",
     )
-    plt.plot(
-        models_df["datetime"],
-        models_df["smooth_wind_min"],
+    ax.plot(
+        datetimes,
+        cube.observation("smooth_wind_min"),
         label="Min",
         linestyle="dotted",
         color="gray",
     )
-    plt.plot(
-        models_df["datetime"],
-        models_df["smooth_wind_max"],
+    ax.plot(
+        datetimes,
+        cube.observation("smooth_wind_max"),
         label="Max",
         linestyle="dashed",
         color="gray",
     )
     # plot the waterlevel on a separate scale
-    plt.plot(
-        models_df["datetime"],
-        models_df["waterlevel"],
+    ax.plot(
+        datetimes,
+        cube.observation("waterlevel"),
         label="Waterlevel",
         linestyle="solid",
         color="blue",
     )
     # Add plot details
-    plt.grid(True)
-    plt.axhspan(15, 20, color="green", alpha=0.2)
-    plt.axhspan(20, 25, color="orange", alpha=0.2)
-    plt.axhspan(25, 30, color="red", alpha=0.2)
-    plt.xticks(tick_positions, tick_labels, fontsize=8)
-    plt.legend()
-    plt.title(f"Wind forecast for {args.location}")
-    plt.xlabel("Time")
-    plt.ylabel("Wind Speed [kn]")
-    # save the figure
-    plt.savefig(f"../../Downloads/{args.location}.png")
-    plt.show()
+    ax.grid(True)
+    ax.axhspan(15, 20, color="green", alpha=0.2)
+    ax.axhspan(20, 25, color="orange", alpha=0.2)
+    ax.axhspan(25, 30, color="red", alpha=0.2)
+    ax.set_xticks(tick_positions, tick_labels, fontsize=8)
+    ax.legend()
+    ax.set_title(f"Wind forecast for {location}")
+    ax.set_xlabel("Time")
+    ax.set_ylabel("Wind Speed [kn]")
+
+
+def draw_mse(ax, forecast):
+    # the smoothed mean squared error of every model
+    models = forecast["models"]
+    cube = forecast["cube"]
+    datetimes = cube.datetimes
+    location = forecast["location"]
+    colors = COLORS
+    tick_positions, tick_labels = generate_labels(datetimes[::4])
 
     # plot the mean squared error
     # print(models_df.to_string())
-    plt.figure(figsize=(30, 10))
     # x_labels = generate_labels(models_df["datetime"])
     # tick_positions = models_df["datetime"][::4]
     # tick_labels = x_labels
@@ -506,19 +587,66 @@ def get_forecast(location, weatherstation, hours_to_show, past_count_of_15_minut
         #     linestyle="dashed",
         #     color=colors[i],
         # )
-        plt.plot(
-            models_df["datetime"],
-            models_df[f"{model}_mse_smooth"],
+        ax.plot(
+            datetimes,
+            cube.model(model, "mse_smooth"),
             label=f"MSE {model}",
             linestyle="dotted",
             color=colors[i],
         )
-    plt.grid(True)
-    plt.xticks(tick_positions, tick_labels, fontsize=8)
-    plt.legend()
-    plt.title(f"MSE for {args.location}")
-    plt.xlabel("Time")
-    plt.ylabel("MSE")
+    ax.grid(True)
+    ax.set_xticks(tick_positions, tick_labels, fontsize=8)
+    ax.legend()
+    ax.set_title(f"MSE for {location}")
+    ax.set_xlabel("Time")
+    ax.set_ylabel("MSE")
+
+
+def get_forecast(
+    location,
+    weatherstation,
+    hours_to_show,
+    past_count_of_15_minutes,
+    model_workers=1,
+):
+    forecast = build_forecast(
+        location,
+        weatherstation,
+        hours_to_show,
+        past_count_of_15_minutes,
+        model_workers=model_workers,
+    )
+    with stage("plot", location=location, rows=len(forecast["cube"])):
+        plt.figure(figsize=FIGURE_SIZE)
+        draw_forecast(plt.gca(), forecast)
+        # save the figure
+        plt.savefig(f"../../Downloads/{location}.png")
+    plt.show()
+
+    # plot the mean squared error
+    # print(models_df.to_string())
+    plt.figure(figsize=FIGURE_SIZE)
+    draw_mse(plt.gca(), forecast)
+    plt.show()
+
+
+def get_forecasts(pairs, hours_to_show, past_count_of_15_minutes, max_workers=None):
+    forecasts = build_forecasts(
+        pairs, hours_to_show, past_count_of_15_minutes, max_workers=max_workers
+    )
+    # all charts are drawn once every spot is merged and shown together
+    locations = [location for location, weatherstation in forecasts]
+    for (location, weatherstation), forecast in forecasts.items():
+        # a spot asked for with several stations gets one file per station
+        name = location
+        if locations.count(location) > 1:
+            name = f"{location}_{weatherstation}"
+        with stage("plot", location=location, rows=len(forecast["cube"])):
+            plt.figure(figsize=FIGURE_SIZE)
+            draw_forecast(plt.gca(), forecast)
+            plt.savefig(f"../../Downloads/{name}.png")
+            plt.figure(figsize=FIGURE_SIZE)
+            draw_mse(plt.gca(), forecast)
     plt.show()
 
 
@@ -538,15 +666,18 @@ def parse_args():
         "-l",
         "--location",
         type=str,
-        help="Location to get the forecast for",
+        nargs="+",
+        help="Locations to get the forecast for, several locations are fetched together",
         required=True,
     )
     parser.add_argument(
         "-s",
         "--weather_station",
         type=str,
-        help="Weather station to get the measurements from",
-        required=True,
+        nargs="+",
+        help="Weather station of every location, defaults to the station of the spot",
+        required=False,
+        default=None,
     )
     parser.add_argument(
         "-t",
@@ -564,7 +695,43 @@ def parse_args():
         required=False,
         default=18,
     )
-    return parser.parse_args()
+    parser.add_argument(
+        "--log_level",
+        type=str.upper,
+        choices=LOG_LEVELS,
+        help="Show messages of this level and above, DEBUG shows the frames of every step",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "--metrics",
+        type=str,
+        help="Append stage timings, http requests and memory as json lines to this file",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        help="Number of spots merged at the same time",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "--model_workers",
+        type=int,
+        help="Number of models of a single spot processed at the same time, 0 for every core, "
+        "starting the processes costs more than they save for the usual sizes (see benchmark.py -b models)",
+        required=False,
+        default=1,
+    )
+    args = parser.parse_args()
+    if args.weather_station is not None and len(args.weather_station) != len(
+        args.location
+    ):
+        parser.error("give one weather station per location")
+    return args
 
 
 if __name__ == "__main__":
@@ -572,11 +739,22 @@ if __name__ == "__main__":
     # past_count_of_15_minutes = 100  # max is 8832
 
     args = parse_args()
+    configure(args.log_level, args.metrics)
     # print(args.past_hours)
     past_count_of_15_minutes = args.past_hours * 4
-    get_forecast(
-        args.location,
-        args.weather_station,
-        args.hours_to_show,
-        past_count_of_15_minutes,
-    )
+    weather_stations = args.weather_station or [None] * len(args.location)
+    if len(args.location) == 1:
+        get_forecast(
+            args.location[0],
+            weather_stations[0],
+            args.hours_to_show,
+            past_count_of_15_minutes,
+            args.model_workers,
+        )
+    else:
+        get_forecasts(
+            list(zip(args.location, weather_stations)),
+            args.hours_to_show,
+            past_count_of_15_minutes,
+            args.workers,
+        )
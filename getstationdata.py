@@ -1,13 +1,21 @@
 # get the data from the API
 
-import requests
 import pandas as pd
 import json
 import datetime
+import logging
 import matplotlib.pyplot as plt
 import typing
 import numpy as np
 
+from httpclient import get_session
+from spots import STATIONS
+from stationstore import STATION_STORE_PATH, get_observations
+
+WINDGURU_URL = "https://www.windguru.cz/int/iapi.php"
+METEOSTAT_URL = "https://d.meteostat.net/app/proxy/stations/hourly"
+logger = logging.getLogger(__name__)
+
 
 def generate_labels(dates: typing.List[datetime.datetime]) -> typing.List[str]:
     labels = []
@@ -26,34 +34,76 @@ def get_station_data(
     from_date: datetime.datetime,
     to_date: datetime.datetime,
     sliding_window: int = 1,
+    grid_freq: typing.Optional[str] = None,
+    grid_closed: str = "right",
+    grid_label: str = "right",
+    timeout: typing.Optional[float] = None,
+    store_path: typing.Optional[str] = STATION_STORE_PATH,
 ) -> pd.DataFrame:
-    if station == "wak":
-        return get_station_data_wak("wak", from_date, to_date, sliding_window)
-    if station == "kol":
-        return get_station_data_wak("kol", from_date, to_date, sliding_window)
-    elif station == "keg":
-        return get_station_data_meteostat("06119", from_date, to_date, sliding_window)
-    elif station == "olp":
-        return get_station_data_meteostat("10042", from_date, to_date, sliding_window)
-    elif station == "lis":
-        return get_station_data_meteostat(
-            "10020", from_date, to_date, sliding_window
-        )  # List/Sylt
+    # the station registry tells us which source to ask, with a store_path only the missing part is fetched
+    source = STATIONS.get(station, {}).get("source")
+    if source == "windguru":
+        df = get_station_data_wak(
+            station, from_date, to_date, sliding_window, timeout, store_path
+        )
+    elif source == "meteostat":
+        df = get_station_data_meteostat(
+            station, from_date, to_date, sliding_window, timeout, store_path
+        )
     else:
         # empty dataframe
         return pd.DataFrame()
+    if grid_freq is not None:
+        # the buckets replace the sliding window
+        df = resample_to_grid(df, grid_freq, closed=grid_closed, label=grid_label)
+    return df
 
 
-def get_station_data_meteostat(
+def resample_to_grid(
+    df: pd.DataFrame,
+    freq: str = "15min",
+    closed: str = "right",
+    label: str = "right",
+) -> pd.DataFrame:
+    # aggregate the measurements to the forecast grid, avg, min and max per bucket
+    # with the defaults the bucket (13:45, 14:00] is labelled 14:00
+    if df.empty:
+        return df
+    grouped = df.set_index("datetime").resample(freq, closed=closed, label=label)
+    grid_df = pd.DataFrame(
+        {
+            "wind_avg": grouped["wind_avg"].mean(),
+            "wind_min": grouped["wind_min"].min(),
+            "wind_max": grouped["wind_max"].max(),
+            "count": grouped["wind_avg"].count(),
+        }
+    )
+    if "temperature" in df.columns:
+        grid_df["temperature"] = grouped["temperature"].mean()
+    if "wind_dir" in df.columns:
+        grid_df["wind_dir"] = grouped["wind_dir"].last()
+    # buckets without any measurement are dropped, not filled
+    grid_df = grid_df[grid_df["count"] > 0]
+    grid_df = grid_df.rename_axis("datetime").reset_index()
+    grid_df["date"] = grid_df["datetime"].dt.date
+    grid_df["time"] = grid_df["datetime"].dt.time
+    grid_df["smooth_wind_avg"] = grid_df["wind_avg"]
+    grid_df["smooth_wind_min"] = grid_df["wind_min"]
+    grid_df["smooth_wind_max"] = grid_df["wind_max"]
+    return grid_df
+
+
+def request_meteostat(
     station: str,
     from_date: datetime.datetime,
     to_date: datetime.datetime,
-    sliding_window: int = 1,
-) -> pd.DataFrame:
-    print(f"Getting station data for keg")
-    url = "https://d.meteostat.net/app/proxy/stations/hourly"
+    timeout: typing.Optional[float] = None,
+) -> typing.Dict[str, typing.Any]:
+    # the json meteostat answers with, in whole days
+    logger.info("Getting station data for %s", station)
+    url = METEOSTAT_URL
     params = {
-        "station": station,
+        "station": STATIONS[station]["id"],
         "tz": "Europe/Copenhagen",
         "start": f"{from_date.strftime('%Y-%m-%d')}",
         "end": f"{to_date.strftime('%Y-%m-%d')}",
@@ -72,11 +122,27 @@ def get_station_data_meteostat(
         "user-agent": "Mozilla/5.0 (Windows NT 10.0; rv:102.0) Gecko/20100101 Firefox/102.0",
         "connection": "keep-alive",
     }
-    session = requests.Session()
-    session.headers.update(headers)
-    response = session.get(url, params=params)
-    station_data = response.json()
-    df = pd.DataFrame(station_data["data"])
+    # the shared session keeps the connection, the headers only go with this request
+    response = get_session().get(url, params=params, headers=headers, timeout=timeout)
+    return response.json()
+
+
+def empty_measurements() -> pd.DataFrame:
+    # what the parsers give for an answer without measurements, e.g. a refresh shortly after the last one
+    return pd.DataFrame(
+        {
+            "datetime": pd.Series([], dtype="datetime64[ns]"),
+            "wind_avg": pd.Series([], dtype="float64"),
+            "wind_min": pd.Series([], dtype="float64"),
+            "wind_max": pd.Series([], dtype="float64"),
+        }
+    )
+
+
+def parse_meteostat(station_data: typing.Dict[str, typing.Any]) -> pd.DataFrame:
+    df = pd.DataFrame(station_data.get("data") or [])
+    if df.empty:
+        return empty_measurements()
     df = df.rename(
         columns={
             "wspd": "wind_avg",
@@ -90,7 +156,37 @@ def get_station_data_meteostat(
     df["wind_max"] = df["wind_max"] / 1.852
     # fill min with zeros as we don't have it
     df["wind_min"] = 0
-    df["datetime"] = pd.to_datetime(df["time"], utc=True)
+    # we ask for Europe/Copenhagen, the times are local wall clock times like the ones of the forecast
+    df["datetime"] = pd.to_datetime(df["time"])
+    return df.drop(columns=["time"])
+
+
+def fetch_meteostat(
+    station: str,
+    from_date: datetime.datetime,
+    to_date: datetime.datetime,
+    timeout: typing.Optional[float] = None,
+) -> pd.DataFrame:
+    # the measurements as meteostat has them, in whole days
+    return parse_meteostat(request_meteostat(station, from_date, to_date, timeout))
+
+
+def get_station_data_meteostat(
+    station: str,
+    from_date: datetime.datetime,
+    to_date: datetime.datetime,
+    sliding_window: int = 1,
+    timeout: typing.Optional[float] = None,
+    store_path: typing.Optional[str] = STATION_STORE_PATH,
+) -> pd.DataFrame:
+    if store_path is None:
+        df = fetch_meteostat(station, from_date, to_date, timeout)
+    else:
+        df = get_observations(
+            station, from_date, to_date, fetch_meteostat, timeout, store_path
+        )
+    if df.empty:
+        return df
     df["date"] = df["datetime"].dt.date
     df["time"] = df["datetime"].dt.time
     df["smooth_wind_avg"] = df["wind_avg"]
@@ -99,20 +195,16 @@ def get_station_data_meteostat(
     return df
 
 
-def get_station_data_wak(
+def request_windguru(
     station: str,
     from_date: datetime.datetime,
     to_date: datetime.datetime,
-    sliding_window: int = 1,
-) -> pd.DataFrame:
-
-    print(f"Getting station data for wak")
-    url = "https://www.windguru.cz/int/iapi.php"
-    id_station = "3737"
-    if station == "wak":
-        id_station = "3737"
-    elif station == "kol":
-        id_station = "3846"
+    timeout: typing.Optional[float] = None,
+) -> typing.Dict[str, typing.Any]:
+    # the json windguru answers with, minute measurements
+    logger.info("Getting station data for %s", station)
+    url = WINDGURU_URL
+    id_station = STATIONS[station]["id"]
     params = {
         "q": "station_data",
         "id_station": id_station,
@@ -135,24 +227,54 @@ def get_station_data_wak(
         "Connection": "keep-alive",
     }
 
-    # Using a session to better replicate curl behavior
-    session = requests.Session()
-    session.headers.update(headers)
-
-    # Making the request
-    response = session.get(url, params=params)
+    # Making the request, the shared session keeps the connection, the headers only go with this request
+    response = get_session().get(url, params=params, headers=headers, timeout=timeout)
     # print(response.text)
 
     # Extract the data from the JSON response
-    station_data = response.json()
+    return response.json()
+
+
+def parse_windguru(station_data: typing.Dict[str, typing.Any]) -> pd.DataFrame:
     # print(station_data)
 
     # Create a dataframe from the data
     df = pd.DataFrame(station_data)
+    if df.empty:
+        return empty_measurements()
     # wiind_avg and wind_min are mixed up
     df = df.rename(columns={"wind_avg": "wind_min", "wind_min": "wind_avg"})
     # print(df.to_string())
     df["datetime"] = pd.to_datetime(df["datetime"])
+    return df
+
+
+def fetch_windguru(
+    station: str,
+    from_date: datetime.datetime,
+    to_date: datetime.datetime,
+    timeout: typing.Optional[float] = None,
+) -> pd.DataFrame:
+    # the minute measurements as windguru has them
+    return parse_windguru(request_windguru(station, from_date, to_date, timeout))
+
+
+def get_station_data_wak(
+    station: str,
+    from_date: datetime.datetime,
+    to_date: datetime.datetime,
+    sliding_window: int = 1,
+    timeout: typing.Optional[float] = None,
+    store_path: typing.Optional[str] = STATION_STORE_PATH,
+) -> pd.DataFrame:
+    if store_path is None:
+        df = fetch_windguru(station, from_date, to_date, timeout)
+    else:
+        df = get_observations(
+            station, from_date, to_date, fetch_windguru, timeout, store_path
+        )
+    if df.empty:
+        return df
     df["date"] = df["datetime"].dt.date
     df["time"] = df["datetime"].dt.time
     df["smooth_wind_avg"] = df["wind_avg"].rolling(window=sliding_window).mean()
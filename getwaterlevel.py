@@ -1,16 +1,98 @@
-import requests
-import json
-import sys
+import datetime
+import typing
 
+import pandas as pd
 
-def get_waterlevel(station):
-    url = f"https://www.pegelonline.wsv.de/webservices/rest-api/v2/stations/{station}/W/measurements.json?start=P10D"
-    r = requests.get(url)
-    data = json.loads(r.text)
-    return data
+from httpclient import get_session
+from stationstore import LOCAL_TIMEZONE, get_observations
+
+PEGELONLINE_URL = "https://www.pegelonline.wsv.de/webservices/rest-api/v2"
+# the water levels are kept per gauge like the station measurements, spots on the same gauge share them
+WATERLEVEL_STORE_PATH = "/home/vhg/repos/wackerwind/data/waterlevels/"
+# a gauge that was asked less than this ago is served from the store, so a batch of spots fetches it once
+REFRESH_AFTER = datetime.timedelta(minutes=1)
+
+
+def request_pegelonline(
+    gauge: str,
+    from_date: datetime.datetime,
+    to_date: datetime.datetime,
+    timeout: typing.Optional[float] = None,
+) -> typing.List[typing.Dict[str, typing.Any]]:
+    # the json measurements between from_date and to_date (naive local time)
+    url = f"{PEGELONLINE_URL}/stations/{gauge}/W/measurements.json"
+    # in the autumn the hour after 2 comes twice and in spring it is skipped, we take the later one
+    params = {
+        "start": pd.Timestamp(from_date)
+        .tz_localize(LOCAL_TIMEZONE, ambiguous=False, nonexistent="shift_forward")
+        .isoformat(),
+        "end": pd.Timestamp(to_date)
+        .tz_localize(LOCAL_TIMEZONE, ambiguous=False, nonexistent="shift_forward")
+        .isoformat(),
+    }
+    r = get_session().get(url, params=params, timeout=timeout)
+    r.raise_for_status()
+    return r.json()
+
+
+def parse_pegelonline(
+    measurements: typing.List[typing.Dict[str, typing.Any]],
+) -> pd.DataFrame:
+    # utc times and float values
+    return pd.DataFrame(
+        {
+            "datetime": pd.to_datetime(
+                [measurement["timestamp"] for measurement in measurements], utc=True
+            ),
+            "value": pd.Series(
+                [measurement["value"] for measurement in measurements],
+                dtype="float64",
+            ),
+        }
+    )
+
+
+def fetch_pegelonline(
+    gauge: str,
+    from_date: datetime.datetime,
+    to_date: datetime.datetime,
+    timeout: typing.Optional[float] = None,
+) -> pd.DataFrame:
+    # the measurements between from_date and to_date (naive local time), with utc times and float values
+    return parse_pegelonline(request_pegelonline(gauge, from_date, to_date, timeout))
+
+
+def get_waterlevels(
+    gauge: str,
+    from_date: datetime.datetime,
+    to_date: datetime.datetime,
+    timeout: typing.Optional[float] = None,
+    store_path: typing.Optional[str] = WATERLEVEL_STORE_PATH,
+) -> pd.Series:
+    # the water level in cm above the gauge zero, indexed by the utc time of the measurement
+    if store_path is None:
+        df = fetch_pegelonline(gauge, from_date, to_date, timeout)
+    else:
+        df = get_observations(
+            gauge,
+            from_date,
+            to_date,
+            fetch_pegelonline,
+            timeout,
+            store_path,
+            refresh_after=REFRESH_AFTER,
+        )
+    if df.empty:
+        return pd.Series(
+            dtype="float64",
+            name="value",
+            index=pd.DatetimeIndex([], tz="UTC", name="datetime"),
+        )
+    return df.set_index("datetime")["value"]
 
 
 if __name__ == "__main__":
     station = "b09f2243-60f0-469a-8f3b-0ea6abc83267"  # kappeln
     station = "22b7dcb3-8c42-4f71-9191-49143ba3a828"  # kalkgrund
-    print(get_waterlevel(station))
+    now = datetime.datetime.now()
+    print(get_waterlevels(station, now - datetime.timedelta(days=10), now))
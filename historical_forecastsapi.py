@@ -1,47 +1,328 @@
-import openmeteo_requests
+# fills the forecast archive from the historical forecast api of open-meteo
+# the api stitches the first hours of every past run of a model into one series, so months of
+# verification data can be had in minutes instead of waiting for saveforecast to collect them
+# the range is split into chunks of a few days that are fetched in parallel, the archive is written from one
+# thread only and every finished chunk is noted in a checkpoint file, so an interrupted backfill resumes
+# where it stopped
+
+import argparse
+import concurrent.futures
+import datetime
+import json
+import logging
+import os
+import threading
+import time
+import typing
 
-import requests_cache
+import openmeteo_requests
 import pandas as pd
-from retry_requests import retry
-
-# Setup the Open-Meteo API client with cache and retry on error
-cache_session = requests_cache.CachedSession(".cache", expire_after=3600)
-retry_session = retry(cache_session, retries=5, backoff_factor=0.2)
-openmeteo = openmeteo_requests.Client(session=retry_session)
-
-# Make sure all required weather variables are listed here
-# The order of variables in hourly or daily is important to assign them correctly below
-url = "https://historical-forecast-api.open-meteo.com/v1/forecast"
-params = {
-    "latitude": 52.52,
-    "longitude": 13.41,
-    "start_date": "2024-08-25",
-    "end_date": "2024-09-07",
-    "minutely_15": "wind_speed_10m",
-    "models": ["meteofrance_arome_france_hd", "dmi_seamless"],
-}
-responses = openmeteo.weather_api(url, params=params)
-
-# Process first location. Add a for-loop for multiple locations or weather models
-response = responses[0]
-print(f"Coordinates {response.Latitude()}°N {response.Longitude()}°E")
-print(f"Elevation {response.Elevation()} m asl")
-print(f"Timezone {response.Timezone()} {response.TimezoneAbbreviation()}")
-print(f"Timezone difference to GMT+0 {response.UtcOffsetSeconds()} s")
-
-# Process minutely_15 data. The order of variables needs to be the same as requested.
-minutely_15 = response.Minutely15()
-minutely_15_wind_speed_10m = minutely_15.Variables(0).ValuesAsNumpy()
-
-minutely_15_data = {
-    "date": pd.date_range(
-        start=pd.to_datetime(minutely_15.Time(), unit="s", utc=True),
-        end=pd.to_datetime(minutely_15.TimeEnd(), unit="s", utc=True),
-        freq=pd.Timedelta(seconds=minutely_15.Interval()),
-        inclusive="left",
-    )
-}
-minutely_15_data["wind_speed_10m"] = minutely_15_wind_speed_10m
-
-minutely_15_dataframe = pd.DataFrame(data=minutely_15_data)
-print(minutely_15_dataframe)
+
+from forecastarchive import ARCHIVE_PATH, append_forecast, open_archive
+from httpclient import get_session
+from instrumentation import configure
+from omresponse import MINUTELY_15_VARIABLES, decode_minutely_15
+from spots import MODELS, NUMBERS_TO_MODELS, collected_spots, get_spot
+
+HISTORICAL_URL = "https://historical-forecast-api.open-meteo.com/v1/forecast"
+CHECKPOINT_PATH = "/home/vhg/repos/wackerwind/data/backfill/"
+# open-meteo counts a request of more than two weeks as several calls
+CHUNK_DAYS = 14
+WORKERS = 4
+# well below the 600 calls per minute open-meteo allows without an api key
+REQUESTS_PER_MINUTE = 60
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    # spaces the starts of the requests of all workers evenly
+    def __init__(self, requests_per_minute: float):
+        self.interval = 60 / requests_per_minute
+        self.next_start = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_start)
+            self.next_start = start + self.interval
+        time.sleep(start - now)
+
+
+def chunk_ranges(
+    start_date: datetime.date, end_date: datetime.date, chunk_days: int = CHUNK_DAYS
+) -> typing.List[typing.Tuple[datetime.date, datetime.date]]:
+    # both ends are included, like start_date and end_date of the api
+    chunks = []
+    chunk_start = start_date
+    while chunk_start <= end_date:
+        chunk_end = min(chunk_start + datetime.timedelta(days=chunk_days - 1), end_date)
+        chunks.append((chunk_start, chunk_end))
+        chunk_start = chunk_end + datetime.timedelta(days=1)
+    return chunks
+
+
+def backfill_lead_hour(model: str) -> int:
+    # a stitched value comes from the latest run before it, which can be up to one update interval old
+    return MODELS[model]["update_hours"]
+
+
+def checkpoint_file(location: str, checkpoint_path: str = CHECKPOINT_PATH) -> str:
+    return os.path.join(checkpoint_path, f"{location}.json")
+
+
+def read_checkpoint(
+    location: str, checkpoint_path: str = CHECKPOINT_PATH
+) -> typing.Dict[str, typing.List[str]]:
+    # the start dates of the finished chunks per model
+    path = checkpoint_file(location, checkpoint_path)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_checkpoint(
+    location: str,
+    done: typing.Dict[str, typing.List[str]],
+    checkpoint_path: str = CHECKPOINT_PATH,
+):
+    # written to a temporary file first, an interrupted write leaves the previous checkpoint
+    os.makedirs(checkpoint_path, exist_ok=True)
+    path = checkpoint_file(location, checkpoint_path)
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(done, f, indent=1, sort_keys=True)
+    os.replace(f"{path}.tmp", path)
+
+
+def fetch_chunk(
+    openmeteo,
+    spot: typing.Dict[str, typing.Any],
+    models: typing.List[str],
+    chunk_start: datetime.date,
+    chunk_end: datetime.date,
+    rate_limiter: RateLimiter,
+) -> typing.Dict[str, pd.DataFrame]:
+    # one request for all models of the spot, the decoded frames per model
+    params = {
+        "latitude": spot["latitude"],
+        "longitude": spot["longitude"],
+        "start_date": chunk_start.isoformat(),
+        "end_date": chunk_end.isoformat(),
+        "minutely_15": MINUTELY_15_VARIABLES,
+        "wind_speed_unit": "kn",
+        "timeformat": "unixtime",
+        "timezone": "Europe/Berlin",
+        "models": models,
+    }
+    rate_limiter.wait()
+    responses = openmeteo.weather_api(HISTORICAL_URL, params=params)
+    frames = {}
+    for response in responses:
+        df = decode_minutely_15(response)
+        if df is None:
+            continue
+        frames[NUMBERS_TO_MODELS[response.Model()]] = df[df["wind_speed_10m"].notna()]
+    return frames
+
+
+def save_chunk(
+    location: str,
+    model: str,
+    df: pd.DataFrame,
+    archive_path: str = ARCHIVE_PATH,
+    now: typing.Optional[datetime.datetime] = None,
+) -> int:
+    # valid times that are already archived at this lead hour (by the collector or an earlier backfill) are skipped
+    lead_hour = backfill_lead_hour(model)
+    # a chunk that reaches today also has the forecast for the rest of the day, it was not saved at lead_hour
+    # and would move the latest valid time of the lead hour past the ones the collector saves
+    now = datetime.datetime.now() if now is None else now
+    df = df[df["datetime"] < now].copy()
+    df["save_time"] = df["datetime"] - pd.Timedelta(hours=lead_hour)
+    with open_archive(location, model, archive_path=archive_path) as store:
+        if "data" in store and not df.empty:
+            stored = store.select(
+                "data",
+                where=[
+                    f"lead_hour == {lead_hour}",
+                    f"index >= {df['datetime'].min()!r}",
+                    f"index <= {df['datetime'].max()!r}",
+                ],
+                columns=["lead_hour"],
+            ).index
+            df = df[~df["datetime"].isin(stored)]
+        return append_forecast(store, df, lead_hour)
+
+
+def backfill(
+    locations: typing.List[str],
+    start_date: datetime.date,
+    end_date: datetime.date,
+    models: typing.Optional[typing.List[str]] = None,
+    chunk_days: int = CHUNK_DAYS,
+    workers: int = WORKERS,
+    requests_per_minute: float = REQUESTS_PER_MINUTE,
+    archive_path: str = ARCHIVE_PATH,
+    checkpoint_path: str = CHECKPOINT_PATH,
+    openmeteo=None,
+) -> typing.Dict[typing.Tuple[str, str], int]:
+    # without models every spot is filled with the models it collects, returns the saved rows per (location, model)
+    if openmeteo is None:
+        openmeteo = openmeteo_requests.Client(session=get_session())
+    rate_limiter = RateLimiter(requests_per_minute)
+    # a chunk that reaches today is not complete yet, it is saved but fetched again next time
+    today = datetime.date.today()
+    saved_rows = {}
+    checkpoints = {}
+    jobs = []
+    for location in locations:
+        spot = get_spot(location)
+        spot_models = spot["collect"] if models is None else models
+        checkpoints[spot["name"]] = read_checkpoint(spot["name"], checkpoint_path)
+        for chunk_start, chunk_end in chunk_ranges(start_date, end_date, chunk_days):
+            missing = [
+                model
+                for model in spot_models
+                if chunk_start.isoformat()
+                not in checkpoints[spot["name"]].get(model, [])
+            ]
+            if missing:
+                jobs.append((spot, missing, chunk_start, chunk_end))
+    logger.info("Backfilling %s chunks with %s workers", len(jobs), workers)
+    failed = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(fetch_chunk, openmeteo, *job, rate_limiter): job
+            for job in jobs
+        }
+        # pytables must not be written from several threads, the results are saved here as they come in
+        for future in concurrent.futures.as_completed(futures):
+            spot, chunk_models, chunk_start, chunk_end = futures[future]
+            location = spot["name"]
+            try:
+                frames = future.result()
+            except Exception:
+                logger.exception(
+                    "Chunk %s to %s of %s failed", chunk_start, chunk_end, location
+                )
+                failed.append(futures[future])
+                continue
+            done = checkpoints[location]
+            for model in chunk_models:
+                rows = 0
+                if model in frames:
+                    rows = save_chunk(location, model, frames[model], archive_path)
+                saved_rows[(location, model)] = (
+                    saved_rows.get((location, model), 0) + rows
+                )
+                logger.info(
+                    "Saved %s rows of %s for %s from %s to %s",
+                    rows,
+                    model,
+                    location,
+                    chunk_start,
+                    chunk_end,
+                )
+                if chunk_end < today:
+                    done.setdefault(model, []).append(chunk_start.isoformat())
+                    done[model].sort()
+            write_checkpoint(location, done, checkpoint_path)
+    if failed:
+        logger.warning("%s chunks failed, run again to retry them", len(failed))
+    return saved_rows
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Fill the forecast archive from the historical forecast api"
+    )
+    parser.add_argument(
+        "-l",
+        "--locations",
+        type=str,
+        nargs="+",
+        help="Spots to fill, by default the ones we collect",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "-m",
+        "--models",
+        type=str,
+        nargs="+",
+        choices=list(MODELS),
+        help="Models to fill, by default the ones each spot collects",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "-s",
+        "--start_date",
+        type=datetime.date.fromisoformat,
+        help="First day to fill, YYYY-MM-DD",
+        required=True,
+    )
+    parser.add_argument(
+        "-e",
+        "--end_date",
+        type=datetime.date.fromisoformat,
+        help="Last day to fill, YYYY-MM-DD, by default yesterday",
+        required=False,
+        default=datetime.date.today() - datetime.timedelta(days=1),
+    )
+    parser.add_argument(
+        "-c",
+        "--chunk_days",
+        type=int,
+        help="Days per request",
+        required=False,
+        default=CHUNK_DAYS,
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        help="Requests running at the same time",
+        required=False,
+        default=WORKERS,
+    )
+    parser.add_argument(
+        "-r",
+        "--requests_per_minute",
+        type=float,
+        help="Upper limit of requests per minute",
+        required=False,
+        default=REQUESTS_PER_MINUTE,
+    )
+    parser.add_argument(
+        "--archive_path",
+        type=str,
+        help="Directory of the archive",
+        required=False,
+        default=ARCHIVE_PATH,
+    )
+    parser.add_argument(
+        "--checkpoint_path",
+        type=str,
+        help="Directory of the checkpoint files",
+        required=False,
+        default=CHECKPOINT_PATH,
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    configure()
+    backfill(
+        args.locations or collected_spots(),
+        args.start_date,
+        args.end_date,
+        args.models,
+        args.chunk_days,
+        args.workers,
+        args.requests_per_minute,
+        args.archive_path,
+        args.checkpoint_path,
+    )
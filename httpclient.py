@@ -0,0 +1,81 @@
+# one http session for every fetcher, with a connection pool per host, a cache and retries
+# responses are cached as long as their source usually takes to update, a stale response that came with an
+# ETag or Last-Modified is revalidated with a conditional request instead of being downloaded again
+
+import os
+import threading
+import typing
+
+import requests
+import requests_cache
+from urllib3.util.retry import Retry
+
+from instrumentation import record_response
+
+# the sqlite cache the open-meteo client always used
+CACHE_NAME = ".cache"
+# seconds a response of each host stays fresh, roughly how often the source has something new
+URLS_EXPIRE_AFTER = {
+    # the first matching host counts, past forecasts only change when the current day is part of the range
+    "historical-forecast-api.open-meteo.com": 86400,
+    "*.open-meteo.com": 3600,  # a new model run at most every hour
+    "www.windguru.cz": 60,  # minute data
+    "d.meteostat.net": 1800,  # hourly data
+    "www.pegelonline.wsv.de": 300,  # a new measurement every minute, but we only look at 15 minutes
+}
+# everything else is not cached
+DEFAULT_EXPIRE_AFTER = requests_cache.DO_NOT_CACHE
+RETRIES = 5
+BACKOFF_FACTOR = 0.2
+# connections kept open per host, a multi spot batch asks the same few hosts in parallel
+POOL_CONNECTIONS = 10
+POOL_MAXSIZE = 20
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def make_session(
+    urls_expire_after: typing.Optional[typing.Dict[str, typing.Any]] = None,
+    cache_name: str = CACHE_NAME,
+) -> requests_cache.CachedSession:
+    # urls_expire_after overrides the expiry of single hosts, e.g. a shorter one for open-meteo
+    expire_after = dict(URLS_EXPIRE_AFTER)
+    if urls_expire_after:
+        expire_after.update(urls_expire_after)
+    session = requests_cache.CachedSession(
+        cache_name,
+        expire_after=DEFAULT_EXPIRE_AFTER,
+        urls_expire_after=expire_after,
+        # a stale response is revalidated, unchanged data comes back as a small 304
+        cache_control=False,
+        stale_if_error=True,
+    )
+    retries = Retry(
+        total=RETRIES,
+        backoff_factor=BACKOFF_FACTOR,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["GET", "POST"],
+        raise_on_status=False,
+    )
+    adapter = requests.adapters.HTTPAdapter(
+        max_retries=retries,
+        pool_connections=POOL_CONNECTIONS,
+        pool_maxsize=POOL_MAXSIZE,
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    # latency, size and cache state of every response, only written when the metrics are on
+    session.hooks["response"].append(record_response)
+    return session
+
+
+def get_session(
+    urls_expire_after: typing.Optional[typing.Dict[str, typing.Any]] = None,
+) -> requests_cache.CachedSession:
+    # the shared session of this process, a forked worker makes its own so no connection is shared
+    key = (os.getpid(), tuple(sorted((urls_expire_after or {}).items())))
+    with _sessions_lock:
+        if key not in _sessions:
+            _sessions[key] = make_session(urls_expire_after)
+        return _sessions[key]
@@ -0,0 +1,110 @@
+# opt-in instrumentation, a leveled logger for the messages and json lines for the measurements
+# a stage record has the wall time, the rows it processed and the peak rss of the process, every http request
+# of the shared session gets a record with its latency, size and whether it came from the cache
+# nothing is measured or written unless there is a metrics file, given to configure or in WACKERWIND_METRICS
+
+import contextlib
+import datetime
+import json
+import logging
+import os
+import resource
+import threading
+import time
+import typing
+import urllib.parse
+
+LOG_LEVEL_ENV = "WACKERWIND_LOG_LEVEL"
+METRICS_ENV = "WACKERWIND_METRICS"
+LOG_LEVELS = ["DEBUG", "INFO", "WARNING", "ERROR"]
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+_metrics_file = None
+_metrics_lock = threading.Lock()
+
+
+def configure(
+    level: typing.Optional[str] = None, metrics_path: typing.Optional[str] = None
+):
+    # without arguments the level and the metrics file come from the environment, the messages go to stderr
+    global _metrics_file
+    level = level or os.environ.get(LOG_LEVEL_ENV, "INFO")
+    logging.basicConfig(level=level.upper(), format=LOG_FORMAT)
+    metrics_path = metrics_path or os.environ.get(METRICS_ENV)
+    with _metrics_lock:
+        if _metrics_file is not None:
+            _metrics_file.close()
+            _metrics_file = None
+        if metrics_path:
+            if os.path.dirname(metrics_path):
+                os.makedirs(os.path.dirname(metrics_path), exist_ok=True)
+            # line buffered, so the lines of forked workers do not mix
+            _metrics_file = open(metrics_path, "a", buffering=1)
+
+
+def enabled() -> bool:
+    return _metrics_file is not None
+
+
+def peak_rss_bytes() -> int:
+    # linux counts ru_maxrss in KiB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def emit(kind: str, **fields):
+    if _metrics_file is None:
+        return
+    record = {
+        "time": datetime.datetime.now().isoformat(),
+        "pid": os.getpid(),
+        "kind": kind,
+        **fields,
+    }
+    line = json.dumps(record, default=str) + "\n"
+    with _metrics_lock:
+        if _metrics_file is not None:
+            _metrics_file.write(line)
+
+
+@contextlib.contextmanager
+def stage(name: str, **fields):
+    # with stage("decode", location=location) as record: ... record["rows"] = len(df)
+    # the fields and whatever the block adds to the record are written with the timing
+    record = dict(fields)
+    if _metrics_file is None:
+        yield record
+        return
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        emit(
+            "stage",
+            stage=name,
+            seconds=time.perf_counter() - start,
+            peak_rss_bytes=peak_rss_bytes(),
+            **record,
+        )
+
+
+def record_response(response, *args, **kwargs):
+    # a response hook of the http session, requests calls it once more before the cache has looked at the
+    # response, that call has no from_cache yet and is skipped
+    from_cache = getattr(response, "from_cache", None)
+    if _metrics_file is None or from_cache is None:
+        return
+    url = urllib.parse.urlsplit(response.url)
+    revalidated = getattr(response, "revalidated", False)
+    emit(
+        "http",
+        host=url.netloc,
+        path=url.path,
+        status=response.status_code,
+        # a cache hit keeps the elapsed time of the request it was stored from
+        seconds=(
+            response.elapsed.total_seconds() if not from_cache or revalidated else 0.0
+        ),
+        bytes=len(response.content),
+        from_cache=from_cache,
+        revalidated=revalidated,
+    )
@@ -0,0 +1,60 @@
+# decodes open-meteo responses into frames
+# the times are computed from the integer start, interval and utc offset of the response, the values are
+# views on the flatbuffer that are copied once into the frame
+
+import datetime
+import typing
+
+import numpy as np
+import pandas as pd
+
+# the variables we ask for, the response has them in this order
+MINUTELY_15_VARIABLES = [
+    "apparent_temperature",
+    "precipitation",
+    "wind_speed_10m",
+    "wind_direction_10m",
+    "wind_gusts_10m",
+]
+
+
+def block_times(block, utc_offset_seconds: int = 0, unit: str = "us") -> np.ndarray:
+    # the valid times of a Minutely15() or Hourly() block, shifted by the utc offset into local wall clock time
+    start = block.Time()
+    interval = block.Interval()
+    count = (block.TimeEnd() - start) // interval
+    seconds = start + utc_offset_seconds + np.arange(count, dtype="int64") * interval
+    return seconds.astype("datetime64[s]").astype(f"datetime64[{unit}]")
+
+
+def decode_block(
+    response,
+    block,
+    variables: typing.List[str],
+    aware: bool = False,
+) -> typing.Optional[pd.DataFrame]:
+    # one float32 column per variable and the valid time in a datetime column,
+    # the time is naive local time like everywhere else, with aware it carries the fixed utc offset
+    if not block:
+        return None
+    utc_offset_seconds = response.UtcOffsetSeconds()
+    times = block_times(block, utc_offset_seconds)
+    data = {}
+    for i, variable in enumerate(variables):
+        data[variable] = block.Variables(i).ValuesAsNumpy()
+    df = pd.DataFrame(data)
+    df["datetime"] = times
+    if aware:
+        df["datetime"] = df["datetime"].dt.tz_localize(
+            datetime.timezone(datetime.timedelta(seconds=utc_offset_seconds))
+        )
+    return df
+
+
+def decode_minutely_15(
+    response,
+    variables: typing.List[str] = MINUTELY_15_VARIABLES,
+    aware: bool = False,
+) -> typing.Optional[pd.DataFrame]:
+    # None if the response has no minutely_15 data
+    return decode_block(response, response.Minutely15(), variables, aware)
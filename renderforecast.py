@@ -0,0 +1,248 @@
+# renders the get_forecast charts without a display and caches the images
+# a chart only changes with a new model run or new station data, so the cache key is made of the spot,
+# the options, the current run of every model and the latest station bucket
+
+import argparse
+import concurrent.futures
+import datetime
+import hashlib
+import io
+import logging
+import os
+import typing
+
+import matplotlib
+
+# no display on a server, this has to happen before pyplot is imported
+matplotlib.use("Agg")
+
+import pandas as pd
+from matplotlib.figure import Figure
+
+from collectordaemon import FIRST_POLL_MINUTES, cycle_start
+from getforecast import FIGURE_SIZE, build_forecast, draw_forecast, draw_mse
+from instrumentation import configure
+from spots import MODELS, get_spot
+
+RENDER_CACHE_PATH = "/home/vhg/repos/wackerwind/data/renders/"
+# the station data comes in 15 minute buckets, a newer bucket is newer data
+STATION_FRESHNESS = "15min"
+# renders older than this are removed when the spot is rendered again
+CACHE_MAX_AGE = datetime.timedelta(days=1)
+CHARTS = {"forecast": draw_forecast, "mse": draw_mse}
+FORMATS = ["png", "svg"]
+logger = logging.getLogger(__name__)
+
+
+def forecast_version(
+    location: str,
+    weatherstation: typing.Optional[str],
+    hours_to_show: int,
+    past_hours: int,
+    now: datetime.datetime,
+) -> typing.Tuple[str, list]:
+    # the spot name and everything that changes the data of a forecast
+    spot = get_spot(location)
+    # a run is there a while after its cycle started, until then the previous run is the current one,
+    # the cycles count in UTC like the collector's, now is local time
+    run_time = now.astimezone(datetime.timezone.utc) - datetime.timedelta(
+        minutes=FIRST_POLL_MINUTES
+    )
+    runs = [
+        cycle_start(run_time, MODELS[model]["update_hours"]).isoformat()
+        for model in spot["models"]
+    ]
+    station_bucket = pd.Timestamp(now).floor(STATION_FRESHNESS).isoformat()
+    return spot["name"], [
+        spot["name"],
+        weatherstation or spot["station"],
+        hours_to_show,
+        past_hours,
+        runs,
+        station_bucket,
+    ]
+
+
+def cache_key(
+    location: str,
+    weatherstation: typing.Optional[str],
+    hours_to_show: int,
+    past_hours: int,
+    chart: str,
+    fmt: str,
+    now: datetime.datetime,
+) -> typing.Tuple[str, str]:
+    # the spot name and a digest of everything that changes the image
+    spot_name, version = forecast_version(
+        location, weatherstation, hours_to_show, past_hours, now
+    )
+    key = version + [chart, fmt]
+    return spot_name, hashlib.sha1(repr(key).encode()).hexdigest()[:16]
+
+
+def render_figure(forecast: dict, chart: str = "forecast", fmt: str = "png") -> bytes:
+    # a Figure without pyplot is not tied to any window and can be drawn in any process
+    figure = Figure(figsize=FIGURE_SIZE)
+    CHARTS[chart](figure.add_subplot(), forecast)
+    buffer = io.BytesIO()
+    figure.savefig(buffer, format=fmt)
+    return buffer.getvalue()
+
+
+def prune_cache(spot_name: str, cache_path: str, now: datetime.datetime):
+    for file_name in os.listdir(cache_path):
+        path = os.path.join(cache_path, file_name)
+        if not file_name.startswith(f"{spot_name}_"):
+            continue
+        modified = datetime.datetime.fromtimestamp(os.path.getmtime(path))
+        if now - modified > CACHE_MAX_AGE:
+            os.remove(path)
+
+
+def render_forecast(
+    location: str,
+    weatherstation: typing.Optional[str] = None,
+    hours_to_show: int = 72,
+    past_hours: int = 18,
+    chart: str = "forecast",
+    fmt: str = "png",
+    cache_path: str = RENDER_CACHE_PATH,
+    now: typing.Optional[datetime.datetime] = None,
+) -> bytes:
+    # the image bytes of a chart, from the cache if nothing changed since it was rendered
+    if now is None:
+        now = datetime.datetime.now()
+    spot_name, digest = cache_key(
+        location, weatherstation, hours_to_show, past_hours, chart, fmt, now
+    )
+    path = os.path.join(cache_path, f"{spot_name}_{digest}.{fmt}")
+    if os.path.exists(path):
+        logger.info("Serving %s %s from the cache", location, chart)
+        with open(path, "rb") as f:
+            return f.read()
+    forecast = build_forecast(location, weatherstation, hours_to_show, past_hours * 4)
+    image = render_figure(forecast, chart, fmt)
+    os.makedirs(cache_path, exist_ok=True)
+    prune_cache(spot_name, cache_path, now)
+    # we write next to the cache file and swap it in, so a reader never sees half an image
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(image)
+    os.replace(tmp_path, path)
+    return image
+
+
+def render_spots(
+    locations: typing.List[str],
+    hours_to_show: int = 72,
+    past_hours: int = 18,
+    chart: str = "forecast",
+    fmt: str = "png",
+    cache_path: str = RENDER_CACHE_PATH,
+    max_workers: typing.Optional[int] = None,
+) -> typing.Dict[str, bytes]:
+    # every spot is fetched and drawn in its own process, a failing spot is left out
+    images = {}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            location: executor.submit(
+                render_forecast,
+                location,
+                None,
+                hours_to_show,
+                past_hours,
+                chart,
+                fmt,
+                cache_path,
+            )
+            for location in locations
+        }
+        for location, future in futures.items():
+            try:
+                images[location] = future.result()
+            except Exception:
+                logger.exception("Rendering %s failed", location)
+    return images
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Render forecast charts without a display"
+    )
+    parser.add_argument(
+        "-l",
+        "--locations",
+        type=str,
+        nargs="+",
+        help="Locations to render",
+        required=True,
+    )
+    parser.add_argument(
+        "-c",
+        "--chart",
+        type=str,
+        choices=list(CHARTS),
+        help="Chart to render",
+        required=False,
+        default="forecast",
+    )
+    parser.add_argument(
+        "-f",
+        "--format",
+        type=str,
+        choices=FORMATS,
+        help="Image format",
+        required=False,
+        default="png",
+    )
+    parser.add_argument(
+        "-t",
+        "--hours_to_show",
+        type=int,
+        help="Number of hours to show in the forecast",
+        required=False,
+        default=72,
+    )
+    parser.add_argument(
+        "-p",
+        "--past_hours",
+        type=int,
+        help="Number of past hours to show in the forecast",
+        required=False,
+        default=18,
+    )
+    parser.add_argument(
+        "-o",
+        "--output_path",
+        type=str,
+        help="Directory the images are written to",
+        required=False,
+        default="../../Downloads/",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        help="Number of spots rendered at the same time",
+        required=False,
+        default=None,
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    configure()
+    images = render_spots(
+        args.locations,
+        args.hours_to_show,
+        args.past_hours,
+        args.chart,
+        args.format,
+        max_workers=args.workers,
+    )
+    for location, image in images.items():
+        path = os.path.join(args.output_path, f"{location}.{args.format}")
+        with open(path, "wb") as f:
+            f.write(image)
+        print(f"Wrote {path}")
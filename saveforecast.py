@@ -1,44 +1,100 @@
 import openmeteo_requests
 
-import requests_cache
+import numpy as np
 import pandas as pd
-from retry_requests import retry
 import matplotlib.pyplot as plt
 import datetime
-import os
-
-
-def save_forecast(location, hours_to_show):
-    # Setup the Open-Meteo API client with cache and retry on error
-    cache_session = requests_cache.CachedSession(".cache", expire_after=3600)
-    retry_session = retry(cache_session, retries=5, backoff_factor=0.2)
-    openmeteo = openmeteo_requests.Client(session=retry_session)
-    save_path = "/home/vhg/repos/wackerwind/data/forecasts/"
-
-    models = [
-        "arome_france_hd",
-        "icon_d2",
-        "metno_seamless",
-        "dmi_harmonie_arome_europe",
-        "knmi_harmonie_arome_netherlands",
-        "ukmo_uk_deterministic_2km",
-    ]
-    # parse the location
-    # match anything starting with wack to a specific location
-    if location.lower().startswith("wac") or location.lower().startswith("wak"):
-        latitude = 54.75455
-        longitude = 9.87333
-    elif location.lower().startswith("fal"):
-        latitude = 54.77019
-        longitude = 9.965711
-    else:
-        raise ValueError("Location not supported")
+import logging
+
+from httpclient import get_session
+from forecastarchive import ARCHIVE_PATH, append_forecast, last_valid_time, open_archive
+from instrumentation import configure, stage
+from omresponse import decode_minutely_15
+from spots import NUMBERS_TO_MODELS, collected_spots, get_spot
+
+OPENMETEO_URL = "https://api.open-meteo.com/v1/forecast"
+# open-meteo answers many locations in one request, larger batches are split into chunks of this size
+LOCATIONS_PER_REQUEST = 10
+logger = logging.getLogger(__name__)
+
+
+def save_response(location, model, response, hours_to_show, save_path):
+    logger.info("Model %s for %s", model, location)
+    logger.debug("Coordinates %s°N %s°E", response.Latitude(), response.Longitude())
+
+    # we return how many rows we saved
+    saved_rows = 0
+    # the valid times come in local time (the timezone of the request) straight from the response
+    df = decode_minutely_15(response)
+    if df is not None:
+        # drop anything that is in the past
+        now = datetime.datetime.now()
+        df = df[df["datetime"] > now - pd.Timedelta(minutes=2)]
+        logger.debug("%s", df)
+
+        # we drop anything where the wind_speed_10m is nan
+        df = df[df["wind_speed_10m"].notna()]
+
+        # the lead hour of a row is how many hours after the save it is valid, rounded up, so every row is filed
+        # under its own lead hour however long ago the last save was (models that run every 3 hours are polled
+        # every 3 hours)
+        lead_hours = np.ceil((df["datetime"] - now) / pd.Timedelta(hours=1)).astype(
+            "int64"
+        )
+        # all lead hours of this location and model go into one archive table
+        with open_archive(location, model, archive_path=save_path) as store:
+            # we start at the back, with the rows that look furthest into the future
+            for lead_hour in range(hours_to_show, 0, -1):
+                this_hour_df = df[lead_hours == lead_hour]
+                if this_hour_df.empty:
+                    continue
+                # we check if we have new data, for that we read the last forecast time of this lead hour
+                prev_last_forecast_time = last_valid_time(store, lead_hour)
+                if prev_last_forecast_time is None:
+                    logger.debug("first run")
+                else:
+                    # we get every forecast that is newer than the last forecast time
+                    this_hour_df = this_hour_df[
+                        this_hour_df["datetime"] > prev_last_forecast_time
+                    ]
+                    if this_hour_df.empty:
+                        continue
+                logger.debug("%s", this_hour_df)
+                # we save the current hourly data to the archive
+                saved_rows += append_forecast(
+                    store, this_hour_df.copy(), lead_hour, now
+                )
+        if saved_rows == 0:
+            logger.info("No new data")
+    return saved_rows
+
+
+def get_client(expire_after=3600):
+    # Setup the Open-Meteo API client with the shared session, it caches and retries on error
+    return openmeteo_requests.Client(
+        session=get_session({"*.open-meteo.com": expire_after})
+    )
+
+
+def save_forecasts(
+    locations,
+    hours_to_show,
+    locations_per_request=LOCATIONS_PER_REQUEST,
+    openmeteo=None,
+    models=None,
+):
+    # without a client we make a new one, with models we only save those of the spots' models
+    # returns the saved rows per (location, model)
+    if openmeteo is None:
+        openmeteo = get_client()
+    save_path = ARCHIVE_PATH
+    saved_rows = {}
 
     # Make sure all required weather variables are listed here
-    url = "https://api.open-meteo.com/v1/forecast"
+    url = OPENMETEO_URL
     params = {
-        "latitude": latitude,
-        "longitude": longitude,
+        "latitude": [],
+        "longitude": [],
         # "hourly": [
         #     "apparent_temperature",
         #     "precipitation",
@@ -60,138 +116,50 @@ def save_forecast(location, hours_to_show):
         "forecast_minutely_15": hours_to_show * 4,
         "timeformat": "unixtime",
         "timezone": "Europe/Berlin",
-        "models": models,
+        "models": [],
         # "models": ["icon_d2"],
     }
-    numbers_to_models = {
-        11: "arome_france_hd",  # 1.5km, quarter hourly, every hour updated
-        75: "metno_seamless",  # 1km, hourly, every hour updated
-        23: "icon_d2",  # 2kn, hourly, every hour updated
-        74: "dmi_harmonie_arome_europe",  # 2km, hourly, every 3 hours updated
-        72: "knmi_harmonie_arome_netherlands",  # 2km, hourly, every hour updated
-        81: "ukmo_uk_deterministic_2km",  # 2km, hourly, every hour updated
-    }
-    responses = openmeteo.weather_api(url, params=params)
-
-    # Process first location. Add a for-loop for multiple locations or weather models
-    for response in responses:
-        print(f"\nModel {numbers_to_models[response.Model()]}")
-        print(f"Coordinates {response.Latitude()}°N {response.Longitude()}°E")
-
-        minutely_15 = response.Minutely15()
-        if minutely_15:
-            minutely_15_apparent_temperature = minutely_15.Variables(0).ValuesAsNumpy()
-            minutely_15_precipitation = minutely_15.Variables(1).ValuesAsNumpy()
-            minutely_15_wind_speed_10m = minutely_15.Variables(2).ValuesAsNumpy()
-            minutely_15_wind_direction_10m = minutely_15.Variables(3).ValuesAsNumpy()
-            minutely_15_wind_gusts_10m = minutely_15.Variables(4).ValuesAsNumpy()
-
-            minutely_15_data = {
-                "date": pd.date_range(
-                    start=pd.to_datetime(minutely_15.Time(), unit="s", utc=True),
-                    end=pd.to_datetime(minutely_15.TimeEnd(), unit="s", utc=True),
-                    freq=pd.Timedelta(seconds=minutely_15.Interval()),
-                    inclusive="left",
-                )
-            }
-            minutely_15_data["wind_speed_10m"] = minutely_15_wind_speed_10m
-            minutely_15_data["wind_gusts_10m"] = minutely_15_wind_gusts_10m
-            minutely_15_data["wind_direction_10m"] = minutely_15_wind_direction_10m
-            minutely_15_data["apparent_temperature"] = minutely_15_apparent_temperature
-            minutely_15_data["precipitation"] = minutely_15_precipitation
-
-            df = pd.DataFrame(data=minutely_15_data)
-
-            # we need to correct the date and time to the correct timezone
-            df["date"] = df["date"] + pd.Timedelta(seconds=response.UtcOffsetSeconds())
-
-            # convert the date to iso format
-            df["date"] = df["date"].dt.strftime("%Y-%m-%dT%H:%M:%S")
-            df["datetime"] = pd.to_datetime(df["date"])
-
-            # drop anything that is in the past
-            now = datetime.datetime.now()
-            df = df[df["datetime"] > now - pd.Timedelta(minutes=2)]
-            print(df)
-
-            # we drop anything where the wind_speed_10m is nan
-            df = df[df["wind_speed_10m"].notna()]
-
-            # we split the data according to how far it looks into the future, we start at the back as we know how many hours we got in the forecast, that way we know how old they are
-            last_forecast_time = df["datetime"].max()
-            countdown = hours_to_show
-            # we check if we have new data, for that we read the last forecast time from the hdf5 file
-            if os.path.exists(
-                f"{save_path}{location}_{numbers_to_models[response.Model()]}_{countdown}.h5"
-            ):
-                while True:
-                    prev_last_forecast_time = ""
-                    with pd.HDFStore(
-                        f"{save_path}{location}_{numbers_to_models[response.Model()]}_{countdown}.h5"
-                    ) as store:
-                        temp_df = store["data"]
-                        # turn the datetime into a datetime, we have to amend this as datetime is now the index
-                        temp_df["datetime"] = pd.to_datetime(temp_df.index)
-                        # we check if the last forecast time is the same as the previous last forecast time
-                        prev_last_forecast_time = temp_df["datetime"].max()
-                        if last_forecast_time == prev_last_forecast_time:
-                            print("No new data")
-                            break
-                        # we get every forecast that is newer than the last forecast time
-                        this_hour_df = df[
-                            df["datetime"] > prev_last_forecast_time
-                        ].copy()
-                        this_hour_df["save_time"] = now
-                        this_hour_df["save_time"] = this_hour_df[
-                            "save_time"
-                        ].dt.strftime("%Y-%m-%dT%H:%M:%S")
-                        # turn the datetime into a string
-                        this_hour_df["datetime"] = this_hour_df["datetime"].dt.strftime(
-                            "%Y-%m-%dT%H:%M:%S"
-                        )
-                        # we want the datetime to be the index
-                        this_hour_df = this_hour_df.set_index("datetime")
-                        print(this_hour_df.to_string())
-                        # we save the current hourly data to hdf5
-                        with pd.HDFStore(
-                            f"{save_path}{location}_{numbers_to_models[response.Model()]}_{countdown}.h5"
-                        ) as store:
-                            store.append("data", this_hour_df, format="table")
-                        # we drop the ones that we have already saved
-                        df = df.drop(df[df["datetime"] > prev_last_forecast_time].index)
-                        # we decrease the countdown
-                        countdown -= 1
-                        if countdown == 0:
-                            break
-            else:
-                while df.empty == False:
-                    print("first run")
-                    # we get the last four values as that is the hours_to_show's hour in the future
-                    this_hour_df = df.tail(4).copy()
-                    this_hour_df["save_time"] = now
-                    this_hour_df["save_time"] = this_hour_df["save_time"].dt.strftime(
-                        "%Y-%m-%dT%H:%M:%S"
-                    )
-                    # turn the datetime into a string
-                    this_hour_df["datetime"] = this_hour_df["datetime"].dt.strftime(
-                        "%Y-%m-%dT%H:%M:%S"
+    # spots that archive the same models can share a request
+    spots_by_models = {}
+    for location in locations:
+        spot = get_spot(location)
+        collect = [
+            model for model in spot["collect"] if models is None or model in models
+        ]
+        spots_by_models.setdefault(tuple(collect), []).append(spot)
+    for models, spots in spots_by_models.items():
+        if not models:
+            logger.info("No models to collect for %s", [spot["name"] for spot in spots])
+            continue
+        params["models"] = list(models)
+        # open-meteo takes lists of coordinates, so we ask for many locations in one request
+        for chunk_start in range(0, len(spots), locations_per_request):
+            chunk = spots[chunk_start : chunk_start + locations_per_request]
+            params["latitude"] = [spot["latitude"] for spot in chunk]
+            params["longitude"] = [spot["longitude"] for spot in chunk]
+            with stage(
+                "fetch", locations=[spot["name"] for spot in chunk], models=models
+            ) as record:
+                responses = openmeteo.weather_api(url, params=params)
+                record["responses"] = len(responses)
+
+            # there is one response per location and model, LocationId is the position of the location in the request
+            for response in responses:
+                location = chunk[response.LocationId()]["name"]
+                model = NUMBERS_TO_MODELS[response.Model()]
+                with stage("save", location=location, model=model) as record:
+                    saved_rows[(location, model)] = save_response(
+                        location, model, response, hours_to_show, save_path
                     )
-                    this_hour_df = this_hour_df.set_index("datetime")
-                    print(this_hour_df.to_string())
-                    # we save the current hourly data to hdf5
-                    with pd.HDFStore(
-                        f"{save_path}{location}_{numbers_to_models[response.Model()]}_{countdown}.h5"
-                    ) as store:
-                        store.append("data", this_hour_df, format="table")
-                    # we drop the last four values
-                    df = df.drop(df.tail(4).index)
-                    # we decrease the countdown
-                    countdown -= 1
-                    if countdown == 0:
-                        break
+                    record["rows"] = saved_rows[(location, model)]
+    return saved_rows
+
+
+def save_forecast(location, hours_to_show):
+    save_forecasts([location], hours_to_show)
 
 
 if __name__ == "__main__":
+    configure()
     # we call the function
-    save_forecast("wac", 36)
-    save_forecast("fal", 36)
+    save_forecasts(collected_spots(), 36)
@@ -1,14 +1,12 @@
-import os
-import pandas as pd
 import argparse
 
+from forecastarchive import iter_forecast
+
 
 def show_data(location, model, hour):
-    save_path = "/home/vhg/repos/wackerwind/data/forecasts/"
-    if os.path.exists(f"{save_path}{location}_{model}_{hour}.h5"):
-        with pd.HDFStore(f"{save_path}{location}_{model}_{hour}.h5") as store:
-            temp_df = store["data"]
-            print(temp_df.to_string())
+    # only the rows of this lead hour are read from the archive, a chunk at a time
+    for i, temp_df in enumerate(iter_forecast(location, model, lead_hours=[hour])):
+        print(temp_df.to_string(header=i == 0))
 
 
 def parse_args():
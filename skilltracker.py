@@ -0,0 +1,313 @@
+# keeps the skill of every model per spot and lead hour, updated incrementally from the archive
+# we only store sums (count, error, squared error), so a new observation is added in O(1) and the skill
+# of any window is the sum of the hourly buckets in it, nothing has to be refetched
+
+import argparse
+import datetime
+import logging
+import os
+import typing
+
+import numpy as np
+import pandas as pd
+
+from asofjoin import asof_join
+from forecastarchive import ARCHIVE_PATH, iter_forecast
+from getstationdata import get_station_data
+from instrumentation import configure
+from spots import SPOTS, collected_spots
+
+SKILL_PATH = "/home/vhg/repos/wackerwind/data/skill.h5"
+SUM_COLUMNS = [
+    "count",
+    "sum_wind_error",
+    "sum_wind_squared_error",
+    "sum_gust_error",
+    "sum_gust_squared_error",
+]
+# where clauses can use these, the bucket (hour of the valid time) is the index
+KEY_COLUMNS = ["location", "model", "lead_hour"]
+# the first update of a spot looks back this far, that is about what the station sources give us
+FIRST_UPDATE_DAYS = 10
+logger = logging.getLogger(__name__)
+
+
+def forecast_errors(
+    forecasts: pd.DataFrame, observations: pd.DataFrame
+) -> pd.DataFrame:
+    # forecasts are archive rows (valid time index, lead_hour), observations the station buckets on the
+    # same grid, we only keep rows with a forecast and a measurement
+    errors = pd.DataFrame(
+        {
+            "lead_hour": forecasts["lead_hour"].to_numpy(),
+            "wind_error": forecasts["wind_speed_10m"].to_numpy(dtype="float64")
+            - observations["smooth_wind_avg"].to_numpy(dtype="float64"),
+            "gust_error": forecasts["wind_gusts_10m"].to_numpy(dtype="float64")
+            - observations["smooth_wind_max"].to_numpy(dtype="float64"),
+        },
+        index=forecasts.index,
+    )
+    return errors.dropna()
+
+
+def bucket_sums(errors: pd.DataFrame) -> pd.DataFrame:
+    # sums per lead hour and hour of the valid time, these are the rows we append
+    errors = errors.assign(
+        bucket=errors.index.floor("h"),
+        wind_squared_error=errors["wind_error"] ** 2,
+        gust_squared_error=errors["gust_error"] ** 2,
+    )
+    sums = errors.groupby(["lead_hour", "bucket"]).agg(
+        count=("wind_error", "size"),
+        sum_wind_error=("wind_error", "sum"),
+        sum_wind_squared_error=("wind_squared_error", "sum"),
+        sum_gust_error=("gust_error", "sum"),
+        sum_gust_squared_error=("gust_squared_error", "sum"),
+    )
+    return sums.reset_index().set_index("bucket")
+
+
+def read_progress(store: pd.HDFStore) -> pd.DataFrame:
+    # the last valid time that went into the sums per location, model and lead hour
+    if "progress" not in store:
+        return pd.DataFrame(
+            {"valid_time": pd.Series(dtype="datetime64[ns]")},
+            index=pd.MultiIndex.from_tuples([], names=KEY_COLUMNS),
+        )
+    return store["progress"]
+
+
+def model_progress(progress: pd.DataFrame, location: str, model: str) -> pd.Series:
+    # the progress of one location and model, indexed by lead hour
+    keys = progress.index
+    mask = (keys.get_level_values("location") == location) & (
+        keys.get_level_values("model") == model
+    )
+    done = progress[mask]["valid_time"]
+    done.index = done.index.get_level_values("lead_hour")
+    return done
+
+
+def update_model(
+    store: pd.HDFStore,
+    location: str,
+    model: str,
+    observations: pd.DataFrame,
+    progress: pd.DataFrame,
+    archive_path: str = ARCHIVE_PATH,
+) -> int:
+    # adds every archived forecast that is newer than the progress and has a measurement,
+    # observations are indexed by the grid time and end at the last measurement
+    if observations.empty:
+        return 0
+    done = model_progress(progress, location, model)
+    start = observations.index.min() if done.empty else done.min()
+    added = 0
+    last_valid_times = {}
+    # the archive is streamed, only one chunk of forecasts is in memory at a time
+    for forecasts in iter_forecast(
+        location,
+        model,
+        start=start,
+        end=observations.index.max(),
+        columns=["wind_speed_10m", "wind_gusts_10m", "lead_hour"],
+        archive_path=archive_path,
+    ):
+        # rows at or before the progress of their lead hour are already in the sums
+        done_until = done.reindex(forecasts["lead_hour"].to_numpy()).to_numpy(
+            dtype="datetime64[ns]"
+        )
+        forecasts = forecasts[~(forecasts.index.to_numpy() <= done_until)]
+        if forecasts.empty:
+            continue
+        matched = asof_join(
+            forecasts.index,
+            observations.rename_axis("datetime").reset_index(),
+            ["smooth_wind_avg", "smooth_wind_max"],
+            tolerance=pd.Timedelta(0),
+        )
+        errors = forecast_errors(forecasts, matched)
+        if not errors.empty:
+            # a bucket can be split over two chunks, its sums just add up when they are read
+            sums = bucket_sums(errors)
+            sums.insert(0, "model", model)
+            sums.insert(0, "location", location)
+            store.append(
+                "sums",
+                sums,
+                format="table",
+                data_columns=KEY_COLUMNS,
+                min_itemsize={"location": 8, "model": 40},
+                complib="blosc",
+                complevel=9,
+            )
+            added += len(errors)
+        chunk_last = (
+            forecasts.rename_axis("datetime")
+            .reset_index()
+            .groupby("lead_hour")["datetime"]
+            .max()
+        )
+        for lead_hour, valid_time in chunk_last.items():
+            last_valid_times[lead_hour] = max(
+                valid_time, last_valid_times.get(lead_hour, valid_time)
+            )
+    # a forecast without a measurement in the past of the last one will not get one any more
+    for lead_hour, valid_time in last_valid_times.items():
+        progress.loc[(location, model, lead_hour), "valid_time"] = valid_time
+    return added
+
+
+def update_skill(
+    locations: typing.Optional[typing.List[str]] = None,
+    skill_path: str = SKILL_PATH,
+    archive_path: str = ARCHIVE_PATH,
+    now: typing.Optional[datetime.datetime] = None,
+) -> typing.Dict[typing.Tuple[str, str], int]:
+    # returns the number of new forecast rows per (location, model)
+    if locations is None:
+        locations = collected_spots()
+    if now is None:
+        now = datetime.datetime.now()
+    os.makedirs(os.path.dirname(skill_path), exist_ok=True)
+    added = {}
+    with pd.HDFStore(skill_path, mode="a") as store:
+        progress = read_progress(store)
+        for location in locations:
+            spot = SPOTS[location]
+            done = progress[progress.index.get_level_values("location") == location][
+                "valid_time"
+            ]
+            # we only fetch the measurements we did not use yet
+            from_time = now - datetime.timedelta(days=FIRST_UPDATE_DAYS)
+            if not done.empty:
+                from_time = max(from_time, done.min().to_pydatetime())
+            station_data = get_station_data(
+                spot["station"], from_time, now, grid_freq="15min"
+            )
+            if station_data.empty:
+                logger.warning("No station data for %s", location)
+                continue
+            observations = station_data.set_index("datetime")[
+                ["smooth_wind_avg", "smooth_wind_max"]
+            ]
+            for model in spot["collect"]:
+                added[(location, model)] = update_model(
+                    store, location, model, observations, progress, archive_path
+                )
+                logger.info(
+                    "Added %s rows for %s %s", added[(location, model)], location, model
+                )
+        store.put("progress", progress.sort_index(), format="fixed")
+    return added
+
+
+def read_skill(
+    location: str,
+    models: typing.Optional[typing.List[str]] = None,
+    lead_hours: typing.Optional[typing.Iterable[int]] = None,
+    start: typing.Optional[typing.Any] = None,
+    end: typing.Optional[typing.Any] = None,
+    skill_path: str = SKILL_PATH,
+) -> pd.DataFrame:
+    # skill per model and lead hour over the valid times from start to end, only the sums are read
+    if not os.path.exists(skill_path):
+        return pd.DataFrame()
+    where = [f"location == {location!r}"]
+    if models is not None:
+        where.append(f"model in {list(models)}")
+    if lead_hours is not None:
+        where.append(f"lead_hour in {sorted(int(hour) for hour in lead_hours)}")
+    if start is not None:
+        where.append(f"index >= {pd.Timestamp(start)!r}")
+    if end is not None:
+        where.append(f"index <= {pd.Timestamp(end)!r}")
+    with pd.HDFStore(skill_path, mode="r") as store:
+        if "sums" not in store:
+            return pd.DataFrame()
+        sums = store.select("sums", where=where)
+    # the same bucket can be in several appended rows, sums just add up
+    sums = sums.groupby(["model", "lead_hour"])[SUM_COLUMNS].sum()
+    count = sums["count"].replace(0, np.nan)
+    return pd.DataFrame(
+        {
+            "count": sums["count"],
+            "wind_bias": sums["sum_wind_error"] / count,
+            "wind_mse": sums["sum_wind_squared_error"] / count,
+            "wind_rmse": np.sqrt(sums["sum_wind_squared_error"] / count),
+            "gust_bias": sums["sum_gust_error"] / count,
+            "gust_mse": sums["sum_gust_squared_error"] / count,
+        }
+    )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Track the skill of the models")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    update_parser = subparsers.add_parser(
+        "update", help="Add the new archived forecasts to the skill sums"
+    )
+    update_parser.add_argument(
+        "-l",
+        "--locations",
+        type=str,
+        nargs="+",
+        help="Spots to update, all collected spots by default",
+        required=False,
+        default=None,
+    )
+    show_parser = subparsers.add_parser("show", help="Show the skill of a spot")
+    show_parser.add_argument(
+        "-l", "--location", type=str, help="Spot to show", required=True
+    )
+    show_parser.add_argument(
+        "-m", "--models", type=str, nargs="+", help="Models to show", default=None
+    )
+    show_parser.add_argument(
+        "--lead_hours", type=int, nargs="+", help="Lead hours to show", default=None
+    )
+    show_parser.add_argument(
+        "-d",
+        "--days",
+        type=int,
+        help="Only use the last days, all by default",
+        required=False,
+        default=None,
+    )
+    for subparser in [update_parser, show_parser]:
+        subparser.add_argument(
+            "--skill_path",
+            type=str,
+            help="File with the skill sums",
+            required=False,
+            default=SKILL_PATH,
+        )
+    update_parser.add_argument(
+        "--archive_path",
+        type=str,
+        help="Directory of the archive",
+        required=False,
+        default=ARCHIVE_PATH,
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    configure()
+    if args.command == "update":
+        update_skill(args.locations, args.skill_path, args.archive_path)
+    elif args.command == "show":
+        start = None
+        if args.days is not None:
+            start = datetime.datetime.now() - datetime.timedelta(days=args.days)
+        pd.set_option("display.max_rows", None)
+        print(
+            read_skill(
+                args.location,
+                args.models,
+                args.lead_hours,
+                start=start,
+                skill_path=args.skill_path,
+            ).to_string()
+        )
@@ -0,0 +1,124 @@
+# the spots, weather stations and models we know about
+# the viewer, the collector and the station fetchers all look them up here, adding a spot only needs an entry here
+
+import typing
+
+# pegelonline gauges
+KALKGRUND = "22b7dcb3-8c42-4f71-9191-49143ba3a828"
+KAPPELN = "b09f2243-60f0-469a-8f3b-0ea6abc83267"
+ROMO = "5e92d73f-e4ea-42c1-9f98-91536c17cdff"
+
+# the open-meteo models, number is what response.Model() returns
+MODELS = {
+    "arome_france_hd": {"number": 11, "update_hours": 1},  # 1.5km, quarter hourly
+    "metno_seamless": {"number": 75, "update_hours": 1},  # 1km, hourly
+    "icon_d2": {"number": 23, "update_hours": 1},  # 2kn, hourly
+    "dmi_harmonie_arome_europe": {"number": 74, "update_hours": 3},  # 2km, hourly
+    "knmi_harmonie_arome_netherlands": {"number": 72, "update_hours": 1},  # 2km
+    "ukmo_uk_deterministic_2km": {"number": 81, "update_hours": 1},  # 2km, hourly
+}
+NUMBERS_TO_MODELS = {model["number"]: name for name, model in MODELS.items()}
+
+# the models we show
+VIEWER_MODELS = [
+    "arome_france_hd",
+    "icon_d2",
+    "metno_seamless",
+    "dmi_harmonie_arome_europe",
+    # "knmi_harmonie_arome_netherlands",
+    # "ukmo_uk_deterministic_2km",
+]
+# the models we archive
+COLLECTOR_MODELS = [
+    "arome_france_hd",
+    "icon_d2",
+    "metno_seamless",
+    "dmi_harmonie_arome_europe",
+    "knmi_harmonie_arome_netherlands",
+    "ukmo_uk_deterministic_2km",
+]
+
+# the weather stations, source is the fetcher and id the station id of that source
+STATIONS = {
+    "wak": {"source": "windguru", "id": "3737"},
+    "kol": {"source": "windguru", "id": "3846"},
+    "keg": {"source": "meteostat", "id": "06119"},
+    "olp": {"source": "meteostat", "id": "10042"},
+    "lis": {"source": "meteostat", "id": "10020"},  # List/Sylt
+}
+
+# a location matches a spot if it starts with one of the prefixes of the spot
+# models are the models we show, collect the models we archive for the spot
+SPOTS = {
+    "wac": {
+        "prefixes": ["wac", "wak"],
+        "latitude": 54.75455,
+        "longitude": 9.87333,
+        "station": "wak",
+        "waterlevel": KALKGRUND,
+        "models": VIEWER_MODELS,
+        "collect": COLLECTOR_MODELS,
+    },
+    "sch": {
+        "prefixes": ["sch"],
+        "latitude": 54.86288,
+        "longitude": 9.56499,
+        "station": "kol",
+        "waterlevel": KALKGRUND,
+        "models": VIEWER_MODELS,
+        "collect": [],
+    },
+    "fal": {
+        "prefixes": ["fal"],
+        "latitude": 54.77019,
+        "longitude": 9.965711,
+        "station": "wak",
+        "waterlevel": KALKGRUND,
+        "models": VIEWER_MODELS,
+        "collect": COLLECTOR_MODELS,
+    },
+    "ohr": {
+        "prefixes": ["ohr"],
+        "latitude": 54.760344,
+        "longitude": 9.837195,
+        "station": "wak",
+        "waterlevel": KALKGRUND,
+        "models": VIEWER_MODELS,
+        "collect": [],
+    },
+    "maas": {
+        "prefixes": ["maas"],
+        "latitude": 54.683032,
+        "longitude": 10.001216,
+        "station": "wak",
+        "waterlevel": KAPPELN,
+        "models": VIEWER_MODELS,
+        "collect": [],
+    },
+    "rom": {
+        "prefixes": ["rom"],
+        "latitude": 55.154645,
+        "longitude": 8.474347,
+        "station": "lis",
+        "waterlevel": ROMO,
+        "models": VIEWER_MODELS,
+        "collect": [],
+    },
+}
+
+# every prefix points to its spot, we only need one dict lookup per prefix length
+PREFIXES = {prefix: name for name, spot in SPOTS.items() for prefix in spot["prefixes"]}
+PREFIX_LENGTHS = sorted({len(prefix) for prefix in PREFIXES})
+
+
+def get_spot(location: str) -> typing.Dict[str, typing.Any]:
+    location = location.lower()
+    for length in PREFIX_LENGTHS:
+        name = PREFIXES.get(location[:length])
+        if name is not None:
+            return {"name": name, **SPOTS[name]}
+    raise ValueError("Location not supported")
+
+
+def collected_spots() -> typing.List[str]:
+    return [name for name, spot in SPOTS.items() if spot["collect"]]
@@ -0,0 +1,200 @@
+# keeps the raw station measurements, one append-only table per station
+# a request reads what is stored and only fetches the time since the last stored measurement (and the part
+# before what we ever fetched, if the request reaches further back), so a refresh costs the elapsed time,
+# not the window
+
+import contextlib
+import datetime
+import fcntl
+import logging
+import os
+import typing
+
+import pandas as pd
+
+STATION_STORE_PATH = "/home/vhg/repos/wackerwind/data/stations/"
+# the naive times of a request are local time, the same zone the forecasts are asked in
+LOCAL_TIMEZONE = "Europe/Berlin"
+logger = logging.getLogger(__name__)
+
+
+def station_file(station: str, store_path: str = STATION_STORE_PATH) -> str:
+    return os.path.join(store_path, f"{station}.h5")
+
+
+@contextlib.contextmanager
+def station_lock(path: str):
+    # spots of a batch share stations, only one process may append to a station at a time
+    with open(f"{path}.lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def to_store_time(value: typing.Any, tz: typing.Optional[str]) -> pd.Timestamp:
+    # the table holds naive times, in UTC if the source gives timezone aware ones
+    value = pd.Timestamp(value)
+    if tz is None:
+        return value.tz_localize(None)
+    if value.tz is None:
+        value = value.tz_localize(
+            LOCAL_TIMEZONE, ambiguous=False, nonexistent="shift_forward"
+        )
+    return value.tz_convert("UTC").tz_localize(None)
+
+
+def to_request_time(value: pd.Timestamp, tz: typing.Optional[str]) -> datetime.datetime:
+    # the other way round, a naive local time like the ones get_station_data is called with
+    if tz is not None:
+        value = value.tz_localize("UTC").tz_convert(LOCAL_TIMEZONE).tz_localize(None)
+    return value.to_pydatetime()
+
+
+def read_state(store: pd.HDFStore) -> dict:
+    # tz of the source, the first requested time we fetched, the first and last stored measurement
+    # and when we last asked the source for new ones
+    if "data" not in store:
+        return {
+            "tz": None,
+            "covered_from": None,
+            "first": None,
+            "last": None,
+            "fetched_at": None,
+        }
+    attrs = store.get_storer("data").attrs
+    return {
+        "tz": attrs.tz,
+        "covered_from": attrs.covered_from,
+        "first": attrs.first,
+        "last": attrs.last,
+        "fetched_at": getattr(attrs, "fetched_at", None),
+    }
+
+
+def append_observations(
+    store: pd.HDFStore, df: pd.DataFrame, state: dict, covered_from: pd.Timestamp
+) -> int:
+    # df has a datetime column and the measurements, only rows outside of what is stored are appended
+    if df.empty:
+        # the usual answer to a refresh shortly after the last one, the asked for time is covered all the same
+        if "data" in store:
+            attrs = store.get_storer("data").attrs
+            attrs.covered_from = min(state["covered_from"], covered_from)
+        return 0
+    tz = df["datetime"].dt.tz
+    times = pd.DatetimeIndex(df["datetime"])
+    if tz is not None:
+        times = times.tz_convert("UTC").tz_localize(None)
+    frame = df.drop(columns=["datetime"]).set_index(
+        times.astype("datetime64[ns]").rename("datetime")
+    )
+    if state["last"] is not None:
+        frame = frame[(frame.index < state["first"]) | (frame.index > state["last"])]
+    frame = frame[~frame.index.duplicated(keep="last")].sort_index()
+    if "data" in store:
+        # later fetches can have more or fewer fields, the first one decides the columns
+        frame = frame.reindex(columns=store.select("data", stop=0).columns)
+    else:
+        frame = frame.select_dtypes("number")
+    if not frame.empty:
+        store.append(
+            "data",
+            frame.astype("float64"),
+            format="table",
+            complib="blosc",
+            complevel=9,
+        )
+    if "data" not in store:
+        return 0
+    attrs = store.get_storer("data").attrs
+    if state["last"] is None:
+        attrs.tz = None if tz is None else str(tz)
+        attrs.first = frame.index.min()
+        attrs.last = frame.index.max()
+        attrs.covered_from = min(covered_from, attrs.first)
+    else:
+        if len(frame):
+            attrs.first = min(state["first"], frame.index.min())
+            attrs.last = max(state["last"], frame.index.max())
+        attrs.covered_from = min(state["covered_from"], covered_from)
+    return len(frame)
+
+
+def get_observations(
+    station: str,
+    from_date: datetime.datetime,
+    to_date: datetime.datetime,
+    fetch: typing.Callable[..., pd.DataFrame],
+    timeout: typing.Optional[float] = None,
+    store_path: str = STATION_STORE_PATH,
+    refresh_after: typing.Optional[datetime.timedelta] = None,
+) -> pd.DataFrame:
+    # fetch(station, from_date, to_date, timeout) returns the raw measurements with a datetime column,
+    # with refresh_after the source is only asked for new measurements if the last time (by any process)
+    # is longer ago, e.g. for a source several spots share
+    os.makedirs(store_path, exist_ok=True)
+    path = station_file(station, store_path)
+    with station_lock(path), pd.HDFStore(path, mode="a") as store:
+        state = read_state(store)
+        if state["last"] is None:
+            gaps = [(from_date, to_date)]
+        else:
+            gaps = []
+            tz = state["tz"]
+            if to_store_time(from_date, tz) < state["covered_from"]:
+                # the request reaches further back than we ever fetched
+                gaps.append((from_date, to_request_time(state["covered_from"], tz)))
+            refreshed = state["fetched_at"] is not None and (
+                refresh_after is not None
+                and datetime.datetime.now() - state["fetched_at"] < refresh_after
+            )
+            if to_store_time(to_date, tz) > state["last"] and not refreshed:
+                # the measurement at the last stored time comes again and is dropped
+                gaps.append((to_request_time(state["last"], tz), to_date))
+        refetched = False
+        for gap_from, gap_to in gaps:
+            fetched = fetch(station, gap_from, gap_to, timeout)
+            fetched_tz = None if fetched.empty else fetched["datetime"].dt.tz
+            if (
+                state["last"] is not None
+                and not fetched.empty
+                and (None if fetched_tz is None else str(fetched_tz)) != state["tz"]
+            ):
+                # the stored times are in another zone than the source gives now (meteostat used to be stored
+                # as UTC), they cannot be mixed, so the station starts over with the whole request
+                logger.warning(
+                    "Refetching %s, its stored times are in %s", station, state["tz"]
+                )
+                store.remove("data")
+                state = read_state(store)
+                gap_from, gap_to = from_date, to_date
+                fetched = fetch(station, gap_from, gap_to, timeout)
+                refetched = True
+            # a source without a timezone gives naive local times, an empty answer keeps the stored zone
+            covered_from = to_store_time(
+                gap_from, state["tz"] if fetched.empty else fetched["datetime"].dt.tz
+            )
+            rows = append_observations(store, fetched, state, covered_from)
+            if "data" in store and gap_to == to_date:
+                store.get_storer("data").attrs.fetched_at = datetime.datetime.now()
+            logger.info("Stored %s new measurements for %s", rows, station)
+            state = read_state(store)
+            if refetched:
+                # the whole request is stored, the other gap is in it
+                break
+        if state["last"] is None:
+            return pd.DataFrame()
+        df = store.select(
+            "data",
+            where=[
+                f"index >= {to_store_time(from_date, state['tz'])!r}",
+                f"index <= {to_store_time(to_date, state['tz'])!r}",
+            ],
+        )
+    # a head fill is appended after the newer rows, so we sort on the way out
+    df = df.sort_index().rename_axis("datetime").reset_index()
+    if state["tz"] is not None:
+        df["datetime"] = df["datetime"].dt.tz_localize("UTC").dt.tz_convert(state["tz"])
+    return df
@@ -0,0 +1,105 @@
+# the vectorized repair has to give the very same values as the loop get_forecast used before it
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from gaprepair import repair_gaps, repair_gaps_loop, repair_model
+from gapreference import legacy_repair, make_gusts
+
+
+def assert_same_as_legacy(gusts):
+    repaired = repair_gaps(gusts)
+    legacy = legacy_repair(gusts)
+    assert repaired.dtype == legacy.dtype
+    np.testing.assert_array_equal(repaired, legacy)
+
+
+@pytest.mark.parametrize("rows", [200, 1000])
+@pytest.mark.parametrize("gap_share", [0.0, 0.01, 0.05, 0.3])
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_random_gaps(rows, gap_share, seed):
+    assert_same_as_legacy(make_gusts(rows, gap_share, seed=seed))
+
+
+def test_run_of_zeros():
+    # a run of zeros repairs into zeros again, so the vectorized repair falls back to the loop
+    assert_same_as_legacy(np.zeros(40, dtype="float32"))
+
+
+def test_gaps_at_the_edges_stay():
+    # the first and last 4 values have no full window, they are not repaired
+    gusts = make_gusts(40, 0.0)
+    gusts[[0, 3, 36, 39]] = 0
+    repaired = repair_gaps(gusts)
+    assert (repaired[[0, 3, 36, 39]] == 0).all()
+    assert_same_as_legacy(gusts)
+
+
+@pytest.mark.parametrize("nans", [1, 4, 6])
+def test_leading_and_trailing_nans(nans):
+    gusts = make_gusts(100, 0.05, seed=nans).astype("float64")
+    gusts[:nans] = np.nan
+    gusts[-nans:] = np.nan
+    gusts[nans + 1] = 0
+    gusts[-nans - 2] = 0
+    assert_same_as_legacy(gusts)
+
+
+def test_nans_inside():
+    gusts = make_gusts(100, 0.05, seed=3).astype("float64")
+    gusts[[20, 50, 51]] = np.nan
+    gusts[[24, 48]] = 0
+    assert_same_as_legacy(gusts)
+
+
+def test_zero_after_the_last_hit():
+    # both window ends of the first hit are zeros, so its window is filled with zeros and repaired again
+    assert_same_as_legacy(
+        np.array([0, 5, 5, 5, 0, 5, 5, 5, 0, 5, 5, 5], dtype="float32")
+    )
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_random_gaps_with_nans(seed):
+    rng = np.random.default_rng(seed)
+    gusts = make_gusts(int(rng.integers(10, 300)), 0.2, seed=seed).astype("float64")
+    gusts[rng.random(len(gusts)) < 0.03] = np.nan
+    assert_same_as_legacy(gusts)
+
+
+def test_all_nan():
+    assert_same_as_legacy(np.full(50, np.nan))
+
+
+@pytest.mark.parametrize("rows", [0, 1, 8, 9])
+def test_short_frames(rows):
+    # shorter than a window, nothing or only the middle value can be repaired
+    assert_same_as_legacy(np.zeros(rows, dtype="float32"))
+    assert_same_as_legacy(make_gusts(rows, 0.5, seed=rows))
+
+
+def test_loop_is_the_reference():
+    gusts = make_gusts(500, 0.05, seed=4)
+    looped = gusts.copy()
+    repair_gaps_loop(looped, 4)
+    np.testing.assert_array_equal(repair_gaps(gusts), looped)
+    np.testing.assert_array_equal(looped, legacy_repair(gusts))
+
+
+def test_input_is_not_changed():
+    gusts = make_gusts(100, 0.05, seed=5)
+    before = gusts.copy()
+    repair_gaps(gusts)
+    np.testing.assert_array_equal(gusts, before)
+
+
+@pytest.mark.parametrize("rows", [1, 100])
+def test_repair_model(rows):
+    gusts = make_gusts(rows, 0.05, seed=6)
+    df = pd.DataFrame({"wind_gusts_10m": gusts, "wind_speed_10m": gusts})
+    repaired = repair_model(df.copy(), "icon_d2")
+    np.testing.assert_array_equal(repaired["wind_gusts_10m"], legacy_repair(gusts))
+    # only the columns of the model's repairs change
+    np.testing.assert_array_equal(repaired["wind_speed_10m"], gusts)
+    pd.testing.assert_frame_equal(repair_model(df.copy(), "metno_seamless"), df)
@@ -0,0 +1,75 @@
+# a refresh of a station store with nothing new in the gap since the last fetch
+
+import datetime
+
+import pandas as pd
+import pytest
+
+from getstationdata import parse_meteostat, parse_windguru
+from getwaterlevel import parse_pegelonline
+from stationstore import get_observations, read_state, station_file
+
+START = datetime.datetime(2024, 10, 13, 12, 0)
+
+
+def pegelonline_fetch(answers):
+    # hands out the measurements of the next answer on every call
+    calls = []
+
+    def fetch(gauge, from_date, to_date, timeout):
+        calls.append((from_date, to_date))
+        return parse_pegelonline(answers[len(calls) - 1])
+
+    return fetch, calls
+
+
+def measurements(times):
+    return [
+        {"timestamp": time.isoformat() + "+02:00", "value": 500.0 + i}
+        for i, time in enumerate(times)
+    ]
+
+
+def test_empty_refresh(tmp_path):
+    times = [START + datetime.timedelta(minutes=15 * i) for i in range(4)]
+    fetch, calls = pegelonline_fetch([measurements(times), []])
+    first = get_observations("gauge", START, times[-1], fetch, store_path=tmp_path)
+    with pd.HDFStore(station_file("gauge", tmp_path), mode="r") as store:
+        before = read_state(store)
+
+    to_date = times[-1] + datetime.timedelta(minutes=10)
+    second = get_observations("gauge", START, to_date, fetch, store_path=tmp_path)
+    assert len(calls) == 2
+    # the empty answer leaves the measurements as they are
+    pd.testing.assert_frame_equal(second, first)
+    with pd.HDFStore(station_file("gauge", tmp_path), mode="r") as store:
+        after = read_state(store)
+    assert after["last"] == before["last"]
+    assert after["covered_from"] == before["covered_from"]
+    assert after["fetched_at"] > before["fetched_at"]
+
+
+def test_empty_head_fill(tmp_path):
+    # an empty answer before what is stored still counts as covered, so it is not asked for again
+    times = [START + datetime.timedelta(minutes=15 * i) for i in range(4)]
+    fetch, calls = pegelonline_fetch([measurements(times), [], []])
+    get_observations("gauge", START, times[-1], fetch, store_path=tmp_path)
+    earlier = START - datetime.timedelta(hours=2)
+    get_observations("gauge", earlier, times[-1], fetch, store_path=tmp_path)
+    get_observations("gauge", earlier, times[-1], fetch, store_path=tmp_path)
+    assert len(calls) == 2
+
+
+@pytest.mark.parametrize(
+    "parse, answer",
+    [
+        (parse_windguru, []),
+        (parse_windguru, {}),
+        (parse_meteostat, {"data": []}),
+        (parse_pegelonline, []),
+    ],
+)
+def test_parse_empty_answer(parse, answer):
+    df = parse(answer)
+    assert df.empty
+    assert "datetime" in df.columns